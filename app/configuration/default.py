@@ -1,22 +1,25 @@
 import os
 
 # Retriever parameters
-API_SEMANTIC_RETRIEVER_PATH = "../models/api_semantic_retrieval.joblib"
+# A single semantic retriever holds the API, user guide and gallery corpora
+SEMANTIC_RETRIEVER_PATH = "../models/semantic_retrieval"
 API_SEMANTIC_TOP_K = 5
 API_LEXICAL_RETRIEVER_PATH = "../models/api_lexical_retrieval.joblib"
 API_LEXICAL_TOP_K = 5
-USER_GUIDE_SEMANTIC_RETRIEVER_PATH = "../models/user_guide_semantic_retrieval.joblib"
 USER_GUIDE_SEMANTIC_TOP_K = 5
 USER_GUIDE_LEXICAL_RETRIEVER_PATH = "../models/user_guide_lexical_retrieval.joblib"
 USER_GUIDE_LEXICAL_TOP_K = 5
-GALLERY_SEMANTIC_RETRIEVER_PATH = "../models/gallery_semantic_retrieval.joblib"
 GALLERY_SEMANTIC_TOP_K = 5
 GALLERY_LEXICAL_RETRIEVER_PATH = "../models/gallery_lexical_retrieval.joblib"
 GALLERY_LEXICAL_TOP_K = 5
+# Number of query embeddings kept in memory by the semantic retriever
+QUERY_CACHE_SIZE = 1_000
 CROSS_ENCODER_PATH = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 CROSS_ENCODER_THRESHOLD = 2.0
 CROSS_ENCODER_MIN_TOP_K = 3
 CROSS_ENCODER_MAX_TOP_K = 20
+# Number of threads querying the retrievers concurrently
+RETRIEVER_N_JOBS = 4
 
 # LLM parameters
 LLM_PATH = "../models/mistral-7b-instruct-v0.2.Q6_K.gguf"
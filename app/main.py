@@ -16,7 +16,7 @@ from schemas import WSMessage
 from sentence_transformers import CrossEncoder
 
 from ragger_duck.prompt import BasicPromptingStrategy
-from ragger_duck.retrieval import RetrieverReranker
+from ragger_duck.retrieval import RetrieverReranker, SemanticRetriever
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -42,30 +42,34 @@ async def send(ws, msg: str, type: str):
 async def startup_event():
     global agent
 
-    api_semantic_retriever = joblib.load(conf.API_SEMANTIC_RETRIEVER_PATH)
+    semantic_retriever = SemanticRetriever.load(conf.SEMANTIC_RETRIEVER_PATH)
     api_lexical_retriever = joblib.load(conf.API_LEXICAL_RETRIEVER_PATH)
-    user_guide_semantic_retriever = joblib.load(conf.USER_GUIDE_SEMANTIC_RETRIEVER_PATH)
     user_guide_lexical_retriever = joblib.load(conf.USER_GUIDE_LEXICAL_RETRIEVER_PATH)
-    gallery_semantic_retriever = joblib.load(conf.GALLERY_SEMANTIC_RETRIEVER_PATH)
     gallery_lexical_retriever = joblib.load(conf.GALLERY_LEXICAL_RETRIEVER_PATH)
     cross_encoder = CrossEncoder(model_name=conf.CROSS_ENCODER_PATH, device=DEVICE)
     retriever = RetrieverReranker(
         retrievers=[
-            api_semantic_retriever.set_params(top_k=conf.API_SEMANTIC_TOP_K),
-            api_lexical_retriever.set_params(top_k=conf.API_LEXICAL_TOP_K),
-            user_guide_semantic_retriever.set_params(
-                top_k=conf.USER_GUIDE_SEMANTIC_TOP_K
+            semantic_retriever.set_params(
+                top_k={
+                    "api": conf.API_SEMANTIC_TOP_K,
+                    "user_guide": conf.USER_GUIDE_SEMANTIC_TOP_K,
+                    "gallery": conf.GALLERY_SEMANTIC_TOP_K,
+                },
+                embedding__query_cache_size=conf.QUERY_CACHE_SIZE,
+                # do not store the embeddings of the queries on disk
+                embedding__embedding_cache_path=None,
             ),
+            api_lexical_retriever.set_params(top_k=conf.API_LEXICAL_TOP_K),
             user_guide_lexical_retriever.set_params(
                 top_k=conf.USER_GUIDE_LEXICAL_TOP_K
             ),
-            gallery_semantic_retriever.set_params(top_k=conf.GALLERY_SEMANTIC_TOP_K),
             gallery_lexical_retriever.set_params(top_k=conf.GALLERY_LEXICAL_TOP_K),
         ],
         cross_encoder=cross_encoder,
         threshold=conf.CROSS_ENCODER_THRESHOLD,
         min_top_k=conf.CROSS_ENCODER_MIN_TOP_K,
         max_top_k=conf.CROSS_ENCODER_MAX_TOP_K,
+        n_jobs=conf.RETRIEVER_N_JOBS,
     )
 
     llm = Llama(
@@ -3,6 +3,7 @@ The module :mod:`ragger_duck.embedding` contains functions to embed transformers
 allowing to embed text.
 """
 
+from ._projection import EmbeddingProjection
 from ._sentence_transformer import SentenceTransformer
 
-__all__ = ["SentenceTransformer"]
+__all__ = ["EmbeddingProjection", "SentenceTransformer"]
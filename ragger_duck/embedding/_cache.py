@@ -0,0 +1,253 @@
+"""Persistent cache of embeddings."""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# Maximum number of parameters in a single SQLite query for old SQLite versions
+SQLITE_MAX_VARIABLES = 999
+
+
+def _hash_text(text):
+    """Content-address a text with SHA-256."""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class SQLiteEmbeddingCache:
+    """Cache of embeddings stored on disk in a SQLite database.
+
+    The embeddings are addressed by the name of the model and the hash of the
+    embedded text such that several models can share the same database. The
+    least recently used embeddings are evicted once the cache exceeds a
+    maximum number of entries.
+
+    The connection to the database is opened lazily and is not pickled: the
+    cache can be pickled with the estimator holding it and reopened in another
+    process.
+
+    Parameters
+    ----------
+    path : str or :class:`pathlib.Path`
+        Path to the SQLite database. It is created if it does not exist.
+
+    model_name : str
+        Name of the model used to compute the embeddings.
+
+    max_size : int, default=None
+        Maximum number of embeddings stored in the database across all models.
+        If None, the cache is unbounded.
+    """
+
+    def __init__(self, path, model_name, max_size=None):
+        self.path = path
+        self.model_name = model_name
+        self.max_size = max_size
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """Connection to the database, opened at the first access."""
+        if self._connection is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                str(self.path), timeout=60, check_same_thread=False
+            )
+            # allow concurrent readers while a process is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "text_hash BLOB NOT NULL, "
+                "embedding BLOB NOT NULL, "
+                "last_used INTEGER NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+                "ON embeddings (last_used)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(self, texts):
+        """Get the embeddings of texts.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to look up.
+
+        Returns
+        -------
+        embeddings : list of ndarray or None
+            The embedding of each text, None when the text is not in the cache.
+        """
+        hashes = [_hash_text(text) for text in texts]
+        found = {}
+        with self._lock:
+            connection = self.connection
+            for start in range(0, len(hashes), SQLITE_MAX_VARIABLES - 1):
+                batch = list(set(hashes[start : start + SQLITE_MAX_VARIABLES - 1]))
+                placeholders = ", ".join("?" * len(batch))
+                found.update(
+                    connection.execute(
+                        (
+                            "SELECT text_hash, embedding FROM embeddings "
+                            f"WHERE model = ? AND text_hash IN ({placeholders})"
+                        ),
+                        [self.model_name, *batch],
+                    ).fetchall()
+                )
+            if found:
+                now = time.time_ns()
+                connection.executemany(
+                    (
+                        "UPDATE embeddings SET last_used = ? "
+                        "WHERE model = ? AND text_hash = ?"
+                    ),
+                    [(now, self.model_name, text_hash) for text_hash in found],
+                )
+                connection.commit()
+        return [
+            (
+                np.frombuffer(found[text_hash], dtype=np.float32)
+                if text_hash in found
+                else None
+            )
+            for text_hash in hashes
+        ]
+
+    def set(self, texts, embeddings):
+        """Store the embeddings of texts.
+
+        Parameters
+        ----------
+        texts : list of str
+            The embedded texts.
+
+        embeddings : ndarray of shape (n_texts, n_features)
+            The embeddings of the texts.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        now = time.time_ns()
+        with self._lock:
+            connection = self.connection
+            connection.executemany(
+                (
+                    "INSERT OR REPLACE INTO embeddings "
+                    "(model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)"
+                ),
+                [
+                    (self.model_name, _hash_text(text), embedding.tobytes(), now)
+                    for text, embedding in zip(texts, embeddings)
+                ],
+            )
+            if self.max_size is not None:
+                # evict the least recently used embeddings
+                connection.execute(
+                    (
+                        "DELETE FROM embeddings WHERE rowid IN ("
+                        "SELECT rowid FROM embeddings ORDER BY last_used DESC "
+                        "LIMIT -1 OFFSET ?)"
+                    ),
+                    (self.max_size,),
+                )
+            connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+
+
+class LRUEmbeddingCache:
+    """Bounded in-memory cache of embeddings with a least recently used policy.
+
+    The embeddings are addressed by their text. The number of hits and misses
+    are recorded to monitor the efficiency of the cache.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of embeddings kept in memory.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, texts):
+        """Get the embeddings of texts.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to look up.
+
+        Returns
+        -------
+        embeddings : list of ndarray or None
+            The embedding of each text, None when the text is not in the cache.
+        """
+        embeddings = []
+        with self._lock:
+            for text in texts:
+                embedding = self._embeddings.get(text)
+                if embedding is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._embeddings.move_to_end(text)
+                embeddings.append(embedding)
+        return embeddings
+
+    def set(self, texts, embeddings):
+        """Store the embeddings of texts.
+
+        Parameters
+        ----------
+        texts : list of str
+            The embedded texts.
+
+        embeddings : ndarray of shape (n_texts, n_features)
+            The embeddings of the texts.
+        """
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                # copy to not keep alive the array of the full batch
+                self._embeddings[text] = np.array(embedding)
+                self._embeddings.move_to_end(text)
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+    def __len__(self):
+        return len(self._embeddings)
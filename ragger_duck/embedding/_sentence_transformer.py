@@ -1,12 +1,115 @@
 """SentenceTransformer with a scikit-learn API."""
 import logging
+import multiprocessing
+import platform
+import threading
 import time
+from functools import partial
+from numbers import Integral
+from pathlib import Path
 
+import numpy as np
+import torch
+from joblib import Parallel, cpu_count, delayed, effective_n_jobs
+from joblib import hash as joblib_hash
 from sentence_transformers import SentenceTransformer as SentenceTransformerBase
 from sklearn.base import BaseEstimator, TransformerMixin, _fit_context
+from sklearn.utils import gen_even_slices
+from sklearn.utils._param_validation import Interval, StrOptions
+
+from ._cache import LRUEmbeddingCache, SQLiteEmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# File of the ONNX model exported by sentence-transformers
+ONNX_FILE_NAME = "onnx/model.onnx"
+
+
+def _onnx_quantization_config():
+    """Quantization configuration of ONNX Runtime for the current CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    # AVX2 is the most widely supported instruction set on x86-64 CPUs
+    return "avx2"
+
+
+# Models loaded in the current process, keyed by the hash of their parameters,
+# i.e. the model name, the device, and the backend. The estimators only store the
+# parameters of their model such that all the estimators sharing the same model,
+# e.g. several retrievers, share the same weights. Worker processes are reused by
+# joblib between calls and thus also load each model only once.
+_MODEL_REGISTRY = {}
+_MODEL_REGISTRY_LOCK = threading.Lock()
+
+
+def _get_model(model_params, key=None):
+    """Get a model from the registry of the process, loading it if needed.
+
+    Parameters
+    ----------
+    model_params : dict
+        The parameters to create the :class:`~sentence_transformers.SentenceTransformer`
+        model.
+
+    key : str, default=None
+        The key of the model in the registry, as given by :func:`joblib.hash` on
+        `model_params`. Hashing the parameters pickles the weights of the models
+        created from `modules` such that the estimators compute the key once. If
+        None, it is computed from `model_params`.
+
+    Returns
+    -------
+    model : :class:`~sentence_transformers.SentenceTransformer`
+        The model shared by all the estimators of the process using the same
+        parameters.
+    """
+    if key is None:
+        key = joblib_hash(model_params)
+    with _MODEL_REGISTRY_LOCK:
+        if key not in _MODEL_REGISTRY:
+            start = time.time()
+            _MODEL_REGISTRY[key] = SentenceTransformerBase(**model_params)
+            logger.info(f"Model loaded in {time.time() - start:.2f}s")
+        return _MODEL_REGISTRY[key]
+
+
+def _encode_in_worker(model_params, model_key, n_threads, sentences, batch_size):
+    """Encode sentences within a worker process.
+
+    Parameters
+    ----------
+    model_params : dict
+        The parameters to create the :class:`~sentence_transformers.SentenceTransformer`
+        model.
+
+    model_key : str
+        The key of the model in the registry of the process.
+
+    n_threads : int
+        The number of threads used by torch within the worker.
+
+    sentences : list of str
+        The sentences to embed.
+
+    batch_size : int
+        The batch size used to encode the sentences.
+
+    Returns
+    -------
+    embedding : ndarray of shape (n_sentences, embedding_size)
+        The normalized embedding of the sentences.
+    """
+    # do not alter the number of threads of the main process with thread-based
+    # backends
+    if multiprocessing.parent_process() is not None:
+        torch.set_num_threads(n_threads)
+    return _get_model(model_params, model_key).encode(
+        sentences,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        normalize_embeddings=True,
+    )
+
 
 class SentenceTransformer(BaseEstimator, TransformerMixin):
     """Sentence transformer that embeds sentences to embeddings.
@@ -15,6 +118,13 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
     that follows the scikit-learn API and thus can be used inside a scikit-learn
     pipeline.
 
+    The model is loaded once per process and shared between all the transformers
+    with the same model name, device, and backend. Pickling the transformer, e.g.
+    within a retriever, only stores the parameters of the model and not its
+    weights: the model is loaded again, or reused, when the unpickled transformer is
+    first used. Models created from `modules` are however pickled with the
+    transformer since they cannot be loaded from a name.
+
     Parameters
     ----------
      model_name_or_path : str, default=None
@@ -42,6 +152,68 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
 
     show_progress_bar : bool, default=True
         Whether to show a progress bar or not during `transform`.
+
+    embedding_cache_path : str, default=None
+        Path to a SQLite database used to cache the embeddings on disk. The
+        embeddings are addressed by `model_name_or_path`, the `backend`, and the
+        hash of the text such that `transform` only encodes the texts that are not
+        in the cache. The database can be shared between models, backends, and
+        runs. If None, no cache is used.
+
+    embedding_cache_max_size : int, default=None
+        Maximum number of embeddings kept in the cache. The least recently used
+        embeddings are evicted first. If None, the cache is unbounded.
+
+    backend : {"torch", "onnx", "onnx-int8"}, default="torch"
+        Backend used to compute the embeddings:
+
+        - `"torch"`: the PyTorch model;
+        - `"onnx"`: the model exported to ONNX and run with ONNX Runtime;
+        - `"onnx-int8"`: the ONNX model with its weights dynamically quantized to
+          8-bit integers, faster and lighter on CPU.
+
+        The model is exported only once into `onnx_folder`. The embeddings remain
+        in the same L2-normalized space: the ONNX model gives the same embeddings
+        as the PyTorch model up to numerical precision (absolute difference of
+        about 1e-6) while the quantized model typically gives embeddings with a
+        cosine similarity above 0.99 with the PyTorch ones, which is enough to
+        query an index built with the PyTorch model. The ONNX backends require
+        `sentence-transformers>=3.2` and `optimum[onnxruntime]`.
+
+    onnx_folder : str, default=None
+        Folder where the ONNX models are exported. If None, the models are exported
+        in a folder named after `model_name_or_path` within `cache_folder`, or
+        within the current directory if `cache_folder` is None. Only used when
+        `backend` is not `"torch"`.
+
+    n_jobs : int, default=None
+        Number of processes used to embed the sentences in `transform`. The
+        sentences are split in `n_jobs` shards embedded in parallel, each process
+        holding its own copy of the model. The processes are reused between calls
+        to `transform` and between estimators sharing the same model such that the
+        model is only loaded once per process. Only the calls to `transform` with
+        more than `batch_size` sentences are parallelized. `None` means 1 unless in
+        a :obj:`joblib.parallel_config` context. `-1` means using all processors.
+
+    n_threads_per_job : int, default=None
+        Number of threads used by torch in each process when `n_jobs` is not 1. If
+        None, the number of cores is evenly split between the processes.
+
+    query_cache_size : int, default=None
+        Maximum number of embeddings kept in an in-memory least recently used
+        cache. The cache is only used when `transform` is called with at most
+        `batch_size` sentences, which is the case when embedding queries, such that
+        repeated queries are not encoded again. Use :meth:`query_cache_info` to
+        monitor the cache. If None, no in-memory cache is used.
+
+    dtype : {"float32", "float16"}, default="float32"
+        Data type of the embeddings returned by `transform`. `"float16"` halves
+        the memory used by the embeddings, e.g. when storing them in a
+        :class:`~ragger_duck.retrieval.SemanticRetriever`. The embeddings are
+        computed and cached in float32 and only cast when returned. bfloat16 is not
+        a NumPy data type: use `codec="bf16"` in
+        :class:`~ragger_duck.retrieval.SemanticRetriever` to store the index in
+        bfloat16 instead.
     """
 
     _parameter_constraints = {
@@ -50,7 +222,25 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
         "device": [str, None],
         "cache_folder": [str, None],
         "use_auth_token": [str, bool, None],
+        "batch_size": [Interval(Integral, left=1, right=None, closed="left")],
         "show_progress_bar": [bool],
+        "embedding_cache_path": [str, None],
+        "embedding_cache_max_size": [
+            Interval(Integral, left=1, right=None, closed="left"),
+            None,
+        ],
+        "backend": [StrOptions({"torch", "onnx", "onnx-int8"})],
+        "onnx_folder": [str, None],
+        "n_jobs": [Integral, None],
+        "n_threads_per_job": [
+            Interval(Integral, left=1, right=None, closed="left"),
+            None,
+        ],
+        "query_cache_size": [
+            Interval(Integral, left=1, right=None, closed="left"),
+            None,
+        ],
+        "dtype": [StrOptions({"float32", "float16"})],
     }
 
     def __init__(
@@ -62,6 +252,14 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
         use_auth_token=None,
         batch_size=32,
         show_progress_bar=True,
+        embedding_cache_path=None,
+        embedding_cache_max_size=None,
+        backend="torch",
+        onnx_folder=None,
+        n_jobs=None,
+        n_threads_per_job=None,
+        query_cache_size=None,
+        dtype="float32",
     ):
         self.model_name_or_path = model_name_or_path
         self.modules = modules
@@ -70,6 +268,14 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
         self.use_auth_token = use_auth_token
         self.batch_size = batch_size
         self.show_progress_bar = show_progress_bar
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_cache_max_size = embedding_cache_max_size
+        self.backend = backend
+        self.onnx_folder = onnx_folder
+        self.n_jobs = n_jobs
+        self.n_threads_per_job = n_threads_per_job
+        self.query_cache_size = query_cache_size
+        self.dtype = dtype
 
     @_fit_context(prefer_skip_nested_validation=False)
     def fit(self, X=None, y=None):
@@ -88,15 +294,271 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
         self
             The fitted estimator.
         """
-        self._embedding = SentenceTransformerBase(
-            model_name_or_path=self.model_name_or_path,
-            modules=self.modules,
-            device=self.device,
-            cache_folder=self.cache_folder,
-            use_auth_token=self.use_auth_token,
-        )
+        self._embedding_cache = None
+        self._get_embedding_cache()
+        self._model_params = self._get_model_params()
+        self._model_key = joblib_hash(self._model_params)
+        # load the model at fit time to not delay the first call to `transform`
+        _get_model(self._model_params, self._model_key)
+        self._query_cache = None
         return self
 
+    def __getstate__(self):
+        # `BaseEstimator.__getstate__` returns the `__dict__` of the instance itself
+        state = super().__getstate__().copy()
+        # only the configuration of the caches is pickled: they are created again
+        # from the parameters when the unpickled transformer is first used
+        state.pop("_embedding_cache", None)
+        state.pop("_query_cache", None)
+        return state
+
+    @property
+    def _embedding(self):
+        """The underlying model, resolved from the registry of the process.
+
+        The model is not stored within the estimator such that pickling the
+        estimator only stores the parameters of the model and not its weights.
+        """
+        # transformers pickled before the key was stored compute it at each call
+        return _get_model(self._model_params, getattr(self, "_model_key", None))
+
+    def _get_embedding_cache(self):
+        """Get the persistent embedding cache, created on demand.
+
+        The cache is created lazily from the current parameters such that it can
+        be enabled or disabled with `set_params` on an already fitted
+        transformer.
+        """
+        if self.embedding_cache_path is None:
+            self._embedding_cache = None
+            return None
+        if self.model_name_or_path is None:
+            raise ValueError(
+                "The embedding cache requires `model_name_or_path` to identify the "
+                "model that computed the embeddings."
+            )
+        embedding_cache = getattr(self, "_embedding_cache", None)
+        cache_params = (
+            self.embedding_cache_path,
+            self._get_cache_model_name(),
+            self.embedding_cache_max_size,
+        )
+        if embedding_cache is None or cache_params != (
+            embedding_cache.path,
+            embedding_cache.model_name,
+            embedding_cache.max_size,
+        ):
+            embedding_cache = SQLiteEmbeddingCache(
+                self.embedding_cache_path,
+                model_name=cache_params[1],
+                max_size=self.embedding_cache_max_size,
+            )
+        self._embedding_cache = embedding_cache
+        return embedding_cache
+
+    def _get_query_cache(self):
+        """Get the in-memory query cache, created on demand.
+
+        The cache is created lazily such that it can be enabled with `set_params`
+        on an already fitted transformer.
+        """
+        query_cache = getattr(self, "_query_cache", None)
+        if self.query_cache_size is None:
+            query_cache = None
+        elif query_cache is None or query_cache.max_size != self.query_cache_size:
+            query_cache = LRUEmbeddingCache(max_size=self.query_cache_size)
+        self._query_cache = query_cache
+        return query_cache
+
+    def query_cache_info(self):
+        """Statistics of the in-memory query cache.
+
+        Returns
+        -------
+        info : dict or None
+            Dictionary with the number of `"hits"` and `"misses"`, the `"size"` and
+            the `"max_size"` of the cache. None if `query_cache_size` is None.
+        """
+        query_cache = self._get_query_cache()
+        if query_cache is None:
+            return None
+        return {
+            "hits": query_cache.hits,
+            "misses": query_cache.misses,
+            "size": len(query_cache),
+            "max_size": query_cache.max_size,
+        }
+
+    def _get_cache_model_name(self):
+        """Name addressing the embeddings of the model in the embedding cache.
+
+        The backends do not give exactly the same embeddings such that the
+        embeddings of the ONNX backends, and of each quantization configuration,
+        are cached apart from the PyTorch ones.
+        """
+        if self.backend == "torch":
+            return self.model_name_or_path
+        if self.backend == "onnx":
+            return f"{self.model_name_or_path}@onnx"
+        # self.backend == "onnx-int8"
+        return f"{self.model_name_or_path}@onnx-int8-{_onnx_quantization_config()}"
+
+    def _get_model_params(self):
+        """Parameters to create the underlying model.
+
+        The model is exported to ONNX, and quantized, if it was not yet exported
+        when using an ONNX backend.
+
+        Returns
+        -------
+        model_params : dict
+            The parameters of :class:`~sentence_transformers.SentenceTransformer`.
+        """
+        model_params = {
+            "model_name_or_path": self.model_name_or_path,
+            "modules": self.modules,
+            "device": self.device,
+            "cache_folder": self.cache_folder,
+            "use_auth_token": self.use_auth_token,
+        }
+        if self.backend == "torch":
+            return model_params
+
+        if self.model_name_or_path is None:
+            raise ValueError(
+                f"The backend {self.backend!r} requires `model_name_or_path` to "
+                "export the model to ONNX."
+            )
+        try:
+            from sentence_transformers.backend import (
+                export_dynamic_quantized_onnx_model,
+            )
+        except ImportError as exc:
+            raise ImportError(
+                f"The backend {self.backend!r} requires sentence-transformers>=3.2 "
+                "and optimum[onnxruntime]."
+            ) from exc
+
+        if self.onnx_folder is not None:
+            onnx_folder = Path(self.onnx_folder)
+        else:
+            onnx_folder = Path(self.cache_folder or ".") / (
+                self.model_name_or_path.replace("/", "_") + "_onnx"
+            )
+        if not (onnx_folder / ONNX_FILE_NAME).exists():
+            start = time.time()
+            # the model is exported to ONNX when loaded with the ONNX backend
+            SentenceTransformerBase(
+                model_name_or_path=self.model_name_or_path,
+                cache_folder=self.cache_folder,
+                use_auth_token=self.use_auth_token,
+                device="cpu",
+                backend="onnx",
+            ).save(str(onnx_folder))
+            logger.info(f"Model exported to ONNX in {time.time() - start:.2f}s")
+
+        file_name = ONNX_FILE_NAME
+        if self.backend == "onnx-int8":
+            quantization_config = _onnx_quantization_config()
+            file_suffix = f"int8_{quantization_config}"
+            file_name = f"onnx/model_{file_suffix}.onnx"
+            if not (onnx_folder / file_name).exists():
+                onnx_model = SentenceTransformerBase(
+                    model_name_or_path=str(onnx_folder),
+                    device="cpu",
+                    backend="onnx",
+                    model_kwargs={"file_name": ONNX_FILE_NAME},
+                )
+                export_dynamic_quantized_onnx_model(
+                    onnx_model,
+                    quantization_config,
+                    str(onnx_folder),
+                    file_suffix=file_suffix,
+                )
+
+        return {
+            "model_name_or_path": str(onnx_folder),
+            "device": self.device,
+            "backend": "onnx",
+            "model_kwargs": {"file_name": file_name},
+        }
+
+    def _encode(self, X):
+        """Encode sentences with the underlying model."""
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs > 1 and len(X) > self.batch_size:
+            return self._encode_parallel(X, n_jobs)
+        return self._embedding.encode(
+            X,
+            batch_size=self.batch_size,
+            show_progress_bar=self.show_progress_bar,
+            # L2-normalize to use dot-product as similarity measure
+            normalize_embeddings=True,
+        )
+
+    def _encode_parallel(self, X, n_jobs):
+        """Encode sentences by shards in several processes."""
+        n_jobs = min(n_jobs, len(X))
+        if self.n_threads_per_job is None:
+            n_threads = max(1, cpu_count() // n_jobs)
+        else:
+            n_threads = self.n_threads_per_job
+        # only the parameters are sent to the workers that load the model once
+        embedding = Parallel(n_jobs=n_jobs)(
+            delayed(_encode_in_worker)(
+                self._model_params,
+                getattr(self, "_model_key", None),
+                n_threads,
+                X[batch],
+                self.batch_size,
+            )
+            for batch in gen_even_slices(len(X), n_jobs)
+        )
+        return np.vstack(embedding)
+
+    @staticmethod
+    def _encode_with_cache(X, cache, encode):
+        """Encode only the sentences that are not in a cache.
+
+        Parameters
+        ----------
+        X : list of str
+            The sentences to embed.
+
+        cache : :class:`SQLiteEmbeddingCache` or :class:`LRUEmbeddingCache`
+            The cache to look up and to update with the missing embeddings.
+
+        encode : callable
+            The function encoding the sentences missing from the cache.
+
+        Returns
+        -------
+        embedding : ndarray of shape (n_sentences, embedding_size)
+            The embedding of the sentences.
+        """
+        embedding = cache.get(X)
+        # identical sentences are only encoded once
+        missing = list(
+            dict.fromkeys(
+                sentence
+                for sentence, sentence_embedding in zip(X, embedding)
+                if sentence_embedding is None
+            )
+        )
+        n_hits = sum(sentence_embedding is not None for sentence_embedding in embedding)
+        logger.info(
+            f"{n_hits} out of {len(X)} sentences found in the {type(cache).__name__}"
+        )
+        if missing:
+            missing_embedding = encode(missing)
+            cache.set(missing, missing_embedding)
+            computed = dict(zip(missing, missing_embedding))
+            embedding = [
+                computed[sentence] if sentence_embedding is None else sentence_embedding
+                for sentence, sentence_embedding in zip(X, embedding)
+            ]
+        return np.vstack(embedding)
+
     def transform(self, X):
         """Embed sentences to vectors.
 
@@ -120,12 +582,16 @@ class SentenceTransformer(BaseEstimator, TransformerMixin):
         elif isinstance(X[0], dict):
             X = [chunk["text"] for chunk in X]
         start = time.time()
-        embedding = self._embedding.encode(
-            X,
-            batch_size=self.batch_size,
-            show_progress_bar=self.show_progress_bar,
-            # L2-normalize to use dot-product as similarity measure
-            normalize_embeddings=True,
-        )
+        encode = self._encode
+        embedding_cache = self._get_embedding_cache()
+        if embedding_cache is not None:
+            encode = partial(
+                self._encode_with_cache, cache=embedding_cache, encode=encode
+            )
+        query_cache = self._get_query_cache()
+        if query_cache is not None and len(X) <= self.batch_size:
+            embedding = self._encode_with_cache(X, cache=query_cache, encode=encode)
+        else:
+            embedding = encode(X)
         logger.info(f"Embedding done in {time.time() - start:.2f}s")
-        return embedding
+        return embedding.astype(self.dtype, copy=False)
@@ -0,0 +1,59 @@
+import pickle
+
+import numpy as np
+
+from ragger_duck.embedding._cache import LRUEmbeddingCache, SQLiteEmbeddingCache
+
+
+def test_sqlite_embedding_cache(tmp_path):
+    """Check that the embeddings are stored and retrieved by model and text."""
+    cache = SQLiteEmbeddingCache(tmp_path / "cache.sqlite", model_name="model 1")
+    assert cache.get(["xxx", "yyy"]) == [None, None]
+
+    embeddings = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    cache.set(["xxx", "yyy"], embeddings)
+    cached = cache.get(["yyy", "zzz", "xxx"])
+    np.testing.assert_array_equal(cached[0], embeddings[1])
+    assert cached[1] is None
+    np.testing.assert_array_equal(cached[2], embeddings[0])
+
+    # the embeddings of another model are not shared
+    other_cache = SQLiteEmbeddingCache(tmp_path / "cache.sqlite", model_name="model 2")
+    assert other_cache.get(["xxx"]) == [None]
+
+    # the cache can be pickled and reopen the database
+    cache_unpickled = pickle.loads(pickle.dumps(cache))
+    np.testing.assert_array_equal(cache_unpickled.get(["xxx"])[0], embeddings[0])
+
+
+def test_sqlite_embedding_cache_eviction(tmp_path):
+    """Check that the least recently used embeddings are evicted."""
+    cache = SQLiteEmbeddingCache(
+        tmp_path / "cache.sqlite", model_name="model", max_size=2
+    )
+    cache.set(["xxx"], np.ones((1, 2)))
+    cache.set(["yyy"], np.ones((1, 2)))
+    cache.get(["xxx"])  # "yyy" becomes the least recently used
+    cache.set(["zzz"], np.ones((1, 2)))
+
+    assert len(cache) == 2
+    assert cache.get(["yyy"]) == [None]
+    assert cache.get(["xxx"])[0] is not None
+    assert cache.get(["zzz"])[0] is not None
+
+
+def test_lru_embedding_cache():
+    """Check the eviction and the statistics of the in-memory cache."""
+    cache = LRUEmbeddingCache(max_size=2)
+    assert cache.get(["xxx"]) == [None]
+    cache.set(["xxx", "yyy"], np.eye(2))
+    cache.get(["xxx"])  # "yyy" becomes the least recently used
+    cache.set(["zzz"], np.ones((1, 2)))
+
+    assert len(cache) == 2
+    assert cache.get(["yyy"]) == [None]
+    np.testing.assert_array_equal(cache.get(["xxx"])[0], [1.0, 0.0])
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    cache_unpickled = pickle.loads(pickle.dumps(cache))
+    np.testing.assert_array_equal(cache_unpickled.get(["zzz"])[0], [1.0, 1.0])
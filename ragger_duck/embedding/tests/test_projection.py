@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import normalize
+
+from ragger_duck.embedding import EmbeddingProjection
+from ragger_duck.embedding._projection import _balance_components
+
+
+@pytest.fixture
+def embedding():
+    """Normalized embedding with a decreasing variance along the features."""
+    rng = np.random.RandomState(0)
+    X = rng.randn(200, 32) * np.logspace(0, -2, 32)
+    return normalize(X).astype(np.float32)
+
+
+@pytest.mark.parametrize("method", ["pca", "opq"])
+def test_embedding_projection(embedding, method):
+    """Check that the projection reduces the dimension and normalizes the
+    embedding."""
+    projection = EmbeddingProjection(n_components=8, method=method, random_state=0)
+    X_projected = projection.fit_transform(embedding)
+
+    assert X_projected.shape == (embedding.shape[0], 8)
+    assert X_projected.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(X_projected, axis=1), 1, rtol=1e-5)
+    assert projection.components_.shape == (8, 32)
+    assert 0.8 < projection.explained_variance_ratio_.sum() <= 1
+    assert 0 < projection.neighbors_recall_ <= 1
+
+    X_projected_float16 = projection.transform(embedding.astype(np.float16))
+    assert X_projected_float16.dtype == np.float16
+
+
+def test_embedding_projection_opq(embedding):
+    """Check that the OPQ projection only reorders the principal components such
+    that the subspaces hold similar variances."""
+    pca = EmbeddingProjection(n_components=8, random_state=0).fit(embedding)
+    opq = EmbeddingProjection(n_components=8, method="opq", pq_m=2, random_state=0).fit(
+        embedding
+    )
+
+    assert opq.neighbors_recall_ == pytest.approx(pca.neighbors_recall_)
+    np.testing.assert_allclose(
+        np.sort(opq.explained_variance_ratio_), np.sort(pca.explained_variance_ratio_)
+    )
+    subspace_variance = opq.explained_variance_ratio_.reshape(2, 4).sum(axis=1)
+    pca_subspace_variance = pca.explained_variance_ratio_.reshape(2, 4).sum(axis=1)
+    assert np.ptp(subspace_variance) < np.ptp(pca_subspace_variance)
+
+    order = _balance_components(np.array([8.0, 4.0, 2.0, 1.0]), n_subspaces=2)
+    assert sorted(order[:2]) == [0, 3]
+    assert sorted(order[2:]) == [1, 2]
+
+
+def test_embedding_projection_lossless(embedding):
+    """Check that keeping all the components keeps the nearest neighbors."""
+    projection = EmbeddingProjection(n_components=64, random_state=0).fit(embedding)
+    assert projection.n_components_ == 32
+    assert projection.explained_variance_ratio_.sum() == pytest.approx(1)
+    assert projection.neighbors_recall_ == pytest.approx(1)
+
+
+def test_embedding_projection_error(embedding):
+    """Check that we raise an error when `pq_m` does not divide the number of
+    components."""
+    projection = EmbeddingProjection(n_components=8, method="opq", pq_m=3)
+    with pytest.raises(ValueError, match="should divide the number of components"):
+        projection.fit(embedding)
@@ -1,9 +1,14 @@
+import pickle
+import sqlite3
 from collections.abc import Iterable
+from contextlib import closing
 from pathlib import Path
 
+import joblib
+import numpy as np
 import pytest
 
-from ragger_duck.embedding import SentenceTransformer
+from ragger_duck.embedding import SentenceTransformer, _sentence_transformer
 
 
 @pytest.mark.parametrize(
@@ -41,3 +46,302 @@ def test_sentence_transformer(input_texts):
     n_sentences = len(input_texts) if isinstance(input_texts, Iterable) else 1
     text_embedded = embedder.fit_transform(input_texts)
     assert text_embedded.shape == (n_sentences, 768)
+
+
+def test_sentence_transformer_embedding_cache(tmp_path, monkeypatch):
+    """Check that only the sentences missing from the cache are encoded."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+        embedding_cache_path=str(tmp_path / "cache.sqlite"),
+    ).fit()
+    encoded_sentences = []
+    encode = embedder._embedding.encode
+
+    def spy_encode(sentences, **kwargs):
+        encoded_sentences.extend(sentences)
+        return encode(sentences, **kwargs)
+
+    # the model is shared within the process: restore it after the test
+    monkeypatch.setattr(embedder._embedding, "encode", spy_encode)
+
+    text_embedded = embedder.transform(["hello world", "hello", "hello world"])
+    assert encoded_sentences == ["hello world", "hello"]
+    np.testing.assert_allclose(text_embedded[0], text_embedded[2])
+
+    encoded_sentences.clear()
+    text_embedded_cached = embedder.transform(["hello", "world", "hello world"])
+    assert encoded_sentences == ["world"]
+    np.testing.assert_allclose(text_embedded_cached[0], text_embedded[1], rtol=1e-6)
+    np.testing.assert_allclose(text_embedded_cached[2], text_embedded[0], rtol=1e-6)
+    assert text_embedded_cached.shape == (3, 768)
+
+
+def test_sentence_transformer_embedding_cache_set_params(tmp_path):
+    """Check that the caches are resolved from the current parameters and are not
+    pickled with the transformer."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+    cache_path = tmp_path / "cache.sqlite"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+        embedding_cache_path=str(cache_path),
+        query_cache_size=10,
+    ).fit()
+    embedder.transform(["hello world", "hello"])
+
+    def n_cached():
+        with closing(sqlite3.connect(cache_path)) as connection:
+            return connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    assert n_cached() == 2
+
+    state = pickle.loads(pickle.dumps(embedder)).__dict__
+    assert "_embedding_cache" not in state and "_query_cache" not in state
+    # pickling does not alter the transformer
+    assert embedder._embedding_cache is not None
+
+    embedder_unpickled = pickle.loads(pickle.dumps(embedder))
+    embedder_unpickled.set_params(embedding_cache_path=None)
+    embedder_unpickled.transform("what user asked")
+    assert n_cached() == 2
+
+    # the cache can be enabled again on a fitted transformer
+    embedder_unpickled.set_params(embedding_cache_path=str(cache_path))
+    embedder_unpickled.transform("another question")
+    assert n_cached() == 3
+
+
+def test_sentence_transformer_embedding_cache_error(tmp_path):
+    """Check that the cache requires a model name."""
+    embedder = SentenceTransformer(
+        embedding_cache_path=str(tmp_path / "cache.sqlite"), modules=[]
+    )
+    with pytest.raises(ValueError, match="requires `model_name_or_path`"):
+        embedder.fit()
+
+
+def test_sentence_transformer_query_cache(monkeypatch):
+    """Check that repeated queries are served from the in-memory cache."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+        batch_size=2,
+        query_cache_size=10,
+    ).fit()
+    encoded_sentences = []
+    encode = embedder._embedding.encode
+
+    def spy_encode(sentences, **kwargs):
+        encoded_sentences.extend(sentences)
+        return encode(sentences, **kwargs)
+
+    # the model is shared within the process: restore it after the test
+    monkeypatch.setattr(embedder._embedding, "encode", spy_encode)
+
+    query_embedded = embedder.transform("hello world")
+    np.testing.assert_allclose(embedder.transform("hello world"), query_embedded)
+    assert encoded_sentences == ["hello world"]
+    assert embedder.query_cache_info() == {
+        "hits": 1,
+        "misses": 1,
+        "size": 1,
+        "max_size": 10,
+    }
+
+    # batches larger than `batch_size` bypass the cache
+    embedder.transform(["hello world", "hello", "world"])
+    assert encoded_sentences == ["hello world", "hello world", "hello", "world"]
+    assert embedder.query_cache_info()["hits"] == 1
+
+    # the cache can be disabled and enabled after fitting
+    embedder.set_params(query_cache_size=None)
+    assert embedder.query_cache_info() is None
+    embedder.set_params(query_cache_size=5)
+    assert embedder.query_cache_info()["size"] == 0
+
+
+def test_sentence_transformer_shared_model():
+    """Check that the transformers share the model of the process and that the
+    model is not pickled."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    params = {
+        "model_name_or_path": model_name_or_path,
+        "cache_folder": str(cache_folder_path),
+        "show_progress_bar": False,
+    }
+    embedder = SentenceTransformer(**params).fit()
+    other_embedder = SentenceTransformer(batch_size=2, **params).fit()
+    assert embedder._embedding is other_embedder._embedding
+
+    pickled = pickle.dumps(embedder)
+    assert len(pickled) < 10_000
+    embedder_unpickled = pickle.loads(pickled)
+    assert embedder_unpickled._embedding is embedder._embedding
+    np.testing.assert_allclose(
+        embedder_unpickled.transform("hello world"), embedder.transform("hello world")
+    )
+
+
+def test_sentence_transformer_model_key(monkeypatch):
+    """Check that the parameters of the model are only hashed at fit time since
+    hashing pickles the weights of the models created from modules."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    hashed_params = []
+
+    def spy_hash(model_params):
+        hashed_params.append(model_params)
+        return joblib.hash(model_params)
+
+    monkeypatch.setattr(_sentence_transformer, "joblib_hash", spy_hash)
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    ).fit()
+    assert len(hashed_params) == 1
+    embedder.transform("hello")
+    embedder.transform(["hello", "world"])
+    assert len(hashed_params) == 1
+
+
+def test_sentence_transformer_dtype(tmp_path):
+    """Check that the embedding is returned in half precision while the cache
+    keeps the embedding in single precision."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    params = {
+        "model_name_or_path": model_name_or_path,
+        "cache_folder": str(cache_folder_path),
+        "show_progress_bar": False,
+        "embedding_cache_path": str(tmp_path / "cache.sqlite"),
+    }
+    input_texts = ["hello world", "hello", "world"]
+    text_embedded = SentenceTransformer(**params).fit_transform(input_texts)
+    assert text_embedded.dtype == np.float32
+
+    embedder = SentenceTransformer(dtype="float16", **params).fit()
+    for _ in range(2):
+        text_embedded_float16 = embedder.transform(input_texts)
+        assert text_embedded_float16.dtype == np.float16
+        np.testing.assert_allclose(text_embedded_float16, text_embedded, atol=1e-3)
+
+
+def test_sentence_transformer_n_jobs():
+    """Check that embedding in several processes gives the same embedding."""
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    input_texts = ["hello world", "hello", "world", "xxx", "yyy"]
+    params = {
+        "model_name_or_path": model_name_or_path,
+        "cache_folder": str(cache_folder_path),
+        "show_progress_bar": False,
+        "batch_size": 2,
+    }
+    text_embedded = SentenceTransformer(**params).fit_transform(input_texts)
+    text_embedded_parallel = SentenceTransformer(
+        n_jobs=2, n_threads_per_job=1, **params
+    ).fit_transform(input_texts)
+    np.testing.assert_allclose(text_embedded_parallel, text_embedded, rtol=1e-5)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_sentence_transformer_onnx_backend(tmp_path, backend):
+    """Check that the ONNX backends embed in the same space as the torch model."""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum")
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    input_texts = ["hello world", "hello", "world"]
+    params = {
+        "model_name_or_path": model_name_or_path,
+        "cache_folder": str(cache_folder_path),
+        "show_progress_bar": False,
+    }
+    text_embedded = SentenceTransformer(**params).fit_transform(input_texts)
+    embedder_onnx = SentenceTransformer(
+        backend=backend, onnx_folder=str(tmp_path / "onnx_model"), **params
+    )
+    text_embedded_onnx = embedder_onnx.fit_transform(input_texts)
+    assert (tmp_path / "onnx_model" / "onnx" / "model.onnx").exists()
+
+    np.testing.assert_allclose(np.linalg.norm(text_embedded_onnx, axis=1), 1, rtol=1e-5)
+    cosine_similarity = (text_embedded * text_embedded_onnx).sum(axis=1)
+    if backend == "onnx":
+        np.testing.assert_allclose(text_embedded_onnx, text_embedded, atol=1e-4)
+    else:
+        assert cosine_similarity.min() > 0.95
+
+    # the model is not exported again
+    onnx_file = tmp_path / "onnx_model" / "onnx" / "model.onnx"
+    modification_time = onnx_file.stat().st_mtime
+    embedder_onnx.fit()
+    assert onnx_file.stat().st_mtime == modification_time
+
+
+def test_sentence_transformer_embedding_cache_model_name():
+    """Check that each backend addresses its own embeddings in the cache."""
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+    model_names = [
+        SentenceTransformer(
+            model_name_or_path=model_name_or_path, backend=backend
+        )._get_cache_model_name()
+        for backend in ("torch", "onnx", "onnx-int8")
+    ]
+    # the embeddings already cached with the torch backend remain valid
+    assert model_names[0] == model_name_or_path
+    assert len(set(model_names)) == 3
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_sentence_transformer_embedding_cache_backend(tmp_path, backend):
+    """Check that the embeddings of the backends are cached apart."""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum")
+    cache_folder_path = Path(__file__).parent / "data"
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    params = {
+        "model_name_or_path": model_name_or_path,
+        "cache_folder": str(cache_folder_path),
+        "show_progress_bar": False,
+        "embedding_cache_path": str(tmp_path / "cache.sqlite"),
+    }
+    SentenceTransformer(**params).fit_transform(["hello world", "hello"])
+    embedder_onnx = SentenceTransformer(
+        backend=backend, onnx_folder=str(tmp_path / "onnx_model"), **params
+    ).fit()
+    assert embedder_onnx._embedding_cache.model_name != model_name_or_path
+
+    encoded_sentences = []
+    encode = embedder_onnx._embedding.encode
+
+    def spy_encode(sentences, **kwargs):
+        encoded_sentences.extend(sentences)
+        return encode(sentences, **kwargs)
+
+    embedder_onnx._embedding.encode = spy_encode
+    try:
+        embedder_onnx.transform(["hello world", "hello"])
+    finally:
+        del embedder_onnx._embedding.encode
+    # the embeddings computed with the torch backend are not reused
+    assert encoded_sentences == ["hello world", "hello"]
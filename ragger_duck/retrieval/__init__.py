@@ -1,5 +1,14 @@
-from ._lexical import BM25Retriever
+from ._lexical import BM25Retriever, PositionalBM25Retriever
 from ._reranking import RetrieverReranker
+from ._result import RetrievalResult
 from ._semantic import SemanticRetriever
+from ._sqlite import SQLiteBM25Retriever
 
-__all__ = ["BM25Retriever", "RetrieverReranker", "SemanticRetriever"]
+__all__ = [
+    "BM25Retriever",
+    "PositionalBM25Retriever",
+    "RetrievalResult",
+    "RetrieverReranker",
+    "SemanticRetriever",
+    "SQLiteBM25Retriever",
+]
@@ -1,15 +1,115 @@
+import heapq
+import itertools
 import logging
 import time
-from numbers import Integral
+from numbers import Integral, Real
 
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy import sparse
 from sklearn.base import BaseEstimator, _fit_context, clone
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.utils._param_validation import HasMethods, Interval
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.utils import gen_batches
+from sklearn.utils._param_validation import HasMethods, Interval, StrOptions
 from sklearn.utils.validation import check_is_fitted
 
+from ._result import RetrievalResult, _format_document
+from ._utils import _get_thread_pool
+
 logger = logging.getLogger(__name__)
 
+# number of queries scored together by `BM25Retriever.query_batch`, bounding the
+# memory of the sparse matrix of scores of a chunk
+QUERY_CHUNK_SIZE = 256
+# minimum number of documents of a shard scored by a thread in `BM25Retriever.query`
+SHARD_MIN_DOCUMENTS = 16_384
+# fraction of the documents above which the partial scores of the MaxScore algorithm
+# are accumulated by scoring all the documents instead of merging sparse postings
+MAXSCORE_DENSE_FRACTION = 0.1
+
+
+def _select_top_k(documents, scores, top_k, n_documents):
+    """Select the `top_k` documents with the highest scores.
+
+    The ties are broken by position such that the selection is deterministic and
+    does not depend on the documents actually scored.
+
+    Parameters
+    ----------
+    documents : ndarray of shape (n_candidates,)
+        The indices of the scored documents. The documents not listed have a null
+        score.
+
+    scores : ndarray of shape (n_candidates,)
+        The scores of the documents.
+
+    top_k : int
+        The number of documents to select.
+
+    n_documents : int
+        The number of documents among which the top documents are selected.
+
+    Returns
+    -------
+    documents : ndarray of shape (min(top_k, n_documents),)
+        The indices of the most relevant documents, by decreasing score.
+
+    scores : ndarray of shape (min(top_k, n_documents),)
+        The scores of the most relevant documents.
+    """
+    top_k = min(top_k, n_documents)
+    if len(documents) < top_k:
+        # fill with documents without any query term, as the exhaustive search
+        # does
+        mask = np.ones(n_documents, dtype=bool)
+        mask[documents] = False
+        padding = np.flatnonzero(mask)[: top_k - len(documents)]
+        documents = np.concatenate([documents, padding])
+        scores = np.concatenate([scores, np.zeros(len(padding))])
+    kth_score = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+    # keep all the documents tied with the k-th one to break ties by position
+    selected = np.flatnonzero(scores >= kth_score)
+    documents, scores = documents[selected], scores[selected]
+    # sort the top documents by decreasing score, breaking ties by position
+    order = np.lexsort((documents, -scores))[:top_k]
+    return documents[order], scores[order]
+
+
+def _merge_postings(documents, scores, term_documents, term_impacts):
+    """Add the impacts of a term to the partial scores of some documents.
+
+    Parameters
+    ----------
+    documents : ndarray of shape (n_documents,)
+        The sorted indices of the documents with a partial score.
+
+    scores : ndarray of shape (n_documents,)
+        The partial scores of the documents.
+
+    term_documents : ndarray of shape (n_postings,)
+        The sorted indices of the documents containing the term.
+
+    term_impacts : ndarray of shape (n_postings,)
+        The impacts of the term in these documents.
+
+    Returns
+    -------
+    documents : ndarray of shape (n_merged,)
+        The sorted indices of the documents of both postings.
+
+    scores : ndarray of shape (n_merged,)
+        The partial scores of the documents including the term.
+    """
+    merged = np.concatenate([documents, term_documents])
+    if not len(merged):
+        return merged, np.empty(0)
+    # the stable sort merges the two sorted runs in linear time
+    order = np.argsort(merged, kind="stable")
+    merged = merged[order]
+    impacts = np.concatenate([scores, term_impacts])[order]
+    starts = np.flatnonzero(np.diff(merged, prepend=-1))
+    return merged[starts], np.add.reduceat(impacts, starts)
+
 
 class BM25Retriever(BaseEstimator):
     """Retrieve the k-nearest neighbors using a lexical search based on BM25.
@@ -20,9 +120,55 @@ class BM25Retriever(BaseEstimator):
         A count vectorizer to compute the count of terms in documents. If None, a
         :class:`sklearn.feature_extraction.text.CountVectorizer` is used.
 
+        A :class:`sklearn.feature_extraction.text.HashingVectorizer` can be used
+        instead to avoid storing the vocabulary, which becomes large with
+        n-grams: the terms are hashed into `n_features` columns on which the
+        document frequencies are computed. It should be created with
+        `alternate_sign=False` and `norm=None` to count the terms. Terms hashed
+        to the same column are confounded.
+
     top_k : int, default=1
         Number of documents to retrieve.
 
+    b : float, default=0.75
+        Strength of the normalization of the term frequencies by the length of the
+        documents.
+
+    k1 : float, default=1.6
+        Saturation of the term frequencies.
+
+    algorithm : {"exhaustive", "maxscore"}, default="exhaustive"
+        Algorithm used to retrieve the top documents:
+
+        - `"exhaustive"`: the score of every document containing a query term is
+          computed;
+        - `"maxscore"`: the postings of the inverted index are traversed with the
+          MaxScore dynamic pruning. The documents that cannot enter the `top_k`
+          documents given the maximum impact of the query terms are skipped such
+          that fewer documents are scored. The partial scores are accumulated
+          in sparse arrays such that the cost of a query depends on the length
+          of the traversed postings and not on the number of documents: it pays
+          off when the queries mix rare and frequent terms. When the postings to
+          traverse cover a large part of the corpus, e.g. for queries made of
+          frequent terms only, all the documents are scored as with
+          `"exhaustive"`. It gives the same documents as `"exhaustive"` up to
+          the order of documents with equal scores.
+
+    impact_dtype : {"float32", "uint8"}, default="float32"
+        Data type of the precomputed BM25 scores of the terms in the documents.
+        `"uint8"` quantizes the scores on 8 bits, dividing the memory of the
+        scores by 4 at the cost of an approximation of the ranking.
+
+    n_jobs : int, default=None
+        Number of threads used to score the queries. :meth:`query` splits the
+        documents in up to `n_jobs` shards of contiguous documents, each scored
+        by a thread that selects its local `top_k` documents, and merges the
+        local top documents. It only applies to the `"exhaustive"` algorithm and
+        to corpora with more than `2 * SHARD_MIN_DOCUMENTS` documents.
+        :meth:`query_batch` scores the chunks of queries in parallel. `None`
+        means 1 unless in a :obj:`joblib.parallel_config` context. `-1` means
+        using all processors.
+
     Attributes
     ----------
     X_fit_ : list of str or dict
@@ -34,26 +180,76 @@ class BM25Retriever(BaseEstimator):
     count_vectorizer_ : transformer
         The count vectorizer used to compute the count of terms in documents.
 
+    document_ids_ : ndarray of shape (n_documents,)
+        Stable identifiers of the documents in `X_fit_`, in increasing order.
+        They are returned in the :class:`RetrievalResult` of the queries and are
+        kept when documents are added or removed.
+
     n_terms_by_document_ : ndarray of shape (n_sentences,)
         The number of terms by document.
 
     averaged_document_length_ : float
-        The average number of terms by document.
+        The average number of terms by document. It is refreshed at the next
+        query after adding or removing documents.
 
     idf_ : ndarray of shape (n_features,)
-        The inverse document frequency.
+        The inverse document frequency. It is refreshed at the next query after
+        adding or removing documents.
+
+    impact_ : sparse matrix of shape (n_documents, n_features)
+        The BM25 score of each term in each document, divided by `impact_scale_`,
+        in CSC format: the columns are the postings of the inverted index. The
+        score of a document for a query is the sum of the columns of the query
+        terms. It is recomputed at the next query when `b`, `k1`, or
+        `impact_dtype` are changed or when documents are added or removed. It is
+        not pickled with the retriever but computed again from `X_counts_` at
+        the first query of the unpickled retriever.
+
+    impact_scale_ : float
+        The scale of the quantized scores in `impact_`. 1.0 when `impact_dtype` is
+        `"float32"`.
+
+    max_impact_ : ndarray of shape (n_features,)
+        The maximum of each column of `impact_`, i.e. the upper bound of the score
+        of each term used by the `"maxscore"` algorithm.
     """
 
     _parameter_constraints = {
         "count_vectorizer": [HasMethods(["fit_transform", "transform"]), None],
         "top_k": [Interval(Integral, left=1, right=None, closed="left")],
+        "b": [Interval(Real, left=0, right=1, closed="both")],
+        "k1": [Interval(Real, left=0, right=None, closed="left")],
+        "algorithm": [StrOptions({"exhaustive", "maxscore"})],
+        "impact_dtype": [StrOptions({"float32", "uint8"})],
+        "n_jobs": [Integral, None],
     }
 
-    def __init__(self, *, count_vectorizer=None, top_k=1, b=0.75, k1=1.6):
+    def __init__(
+        self,
+        *,
+        count_vectorizer=None,
+        top_k=1,
+        b=0.75,
+        k1=1.6,
+        algorithm="exhaustive",
+        impact_dtype="float32",
+        n_jobs=None,
+    ):
         self.count_vectorizer = count_vectorizer
         self.top_k = top_k
         self.b = b
         self.k1 = k1
+        self.algorithm = algorithm
+        self.impact_dtype = impact_dtype
+        self.n_jobs = n_jobs
+
+    def __getstate__(self):
+        # `BaseEstimator.__getstate__` returns the `__dict__` of the instance itself
+        state = super().__getstate__().copy()
+        # the impact is as large as `X_counts_` and is computed again lazily from it
+        for attribute in ("impact_", "max_impact_", "_impact_params"):
+            state.pop(attribute, None)
+        return state
 
     @_fit_context(prefer_skip_nested_validation=False)
     def fit(self, X, y=None):
@@ -82,23 +278,468 @@ class BM25Retriever(BaseEstimator):
             self.count_vectorizer_ = CountVectorizer().fit(X)
         else:
             self.count_vectorizer_ = clone(self.count_vectorizer).fit(X)
+        if isinstance(self.count_vectorizer_, HashingVectorizer) and (
+            self.count_vectorizer_.alternate_sign
+            or self.count_vectorizer_.norm is not None
+        ):
+            raise ValueError(
+                "A HashingVectorizer should be created with alternate_sign=False "
+                "and norm=None to count the terms in documents, got "
+                f"alternate_sign={self.count_vectorizer_.alternate_sign} and "
+                f"norm={self.count_vectorizer_.norm!r}."
+            )
 
-        self.X_counts_ = self.count_vectorizer_.transform(X)
+        self.X_counts_ = sparse.csr_matrix(self.count_vectorizer_.transform(X))
+        self.document_ids_ = np.arange(len(X), dtype=np.int64)
+        self._next_document_id = len(X)
         self.n_terms_by_document_ = self.X_counts_.sum(axis=1).A1
-        self.averaged_document_length_ = self.n_terms_by_document_.mean()
+        # running count of each term over the documents, updated by `partial_fit`
+        # and `remove_sources`
+        self._n_documents_by_term = self.X_counts_.sum(axis=0).A1
+        self._compute_idf()
+        self._compute_impact()
+
+        logger.info(f"BM25Retriever fitted in {time.time() - start:.2f}s")
+        return self
+
+    def _get_n_documents_by_term(self):
+        """Running count of each term over the documents."""
+        # retrievers pickled before the statistics were kept do not store them
+        if not hasattr(self, "_n_documents_by_term"):
+            self._n_documents_by_term = self.X_counts_.sum(axis=0).A1
+        return self._n_documents_by_term
+
+    def _get_document_ids(self):
+        """Identifiers of the documents in `X_fit_`."""
+        # retrievers pickled before the documents had identifiers do not store them
+        if not hasattr(self, "document_ids_"):
+            self.document_ids_ = np.arange(len(self.X_fit_), dtype=np.int64)
+            self._next_document_id = len(self.X_fit_)
+        return self.document_ids_
 
-        # compute idf
+    def _compute_idf(self):
+        """Compute the idf and the average length from the running statistics."""
+        self.averaged_document_length_ = self.n_terms_by_document_.mean()
         n_documents = len(self.X_fit_)
-        n_documents_by_term = self.X_counts_.sum(axis=0).A1
+        n_documents_by_term = self._get_n_documents_by_term()
         numerator = n_documents - n_documents_by_term + 0.5
         denominator = n_documents_by_term + 0.5
         self.idf_ = np.log(numerator / denominator + 1)
-        self.idf_[self.idf_ < 0] = 0.25 * np.mean(self.idf_)
+        # the floor only accounts for the terms found in the documents: not for the
+        # empty columns of a HashingVectorizer nor for the terms of removed documents
+        floored = self.idf_ < 0
+        if floored.any():
+            observed = n_documents_by_term > 0
+            self.idf_[floored] = 0.25 * np.mean(self.idf_[observed])
 
-        logger.info(f"BM25Retriever fitted in {time.time() - start:.2f}s")
+    @_fit_context(prefer_skip_nested_validation=False)
+    def partial_fit(self, X, y=None):
+        """Add new documents to the retriever.
+
+        Only the new documents are vectorized and appended to the counts of
+        terms. The idf and the impact of the terms are refreshed at the next
+        query. With a :class:`~sklearn.feature_extraction.text.CountVectorizer`,
+        the new terms are appended to its vocabulary without applying its options
+        restricting the vocabulary, e.g. `min_df` or `max_features`. If the
+        retriever is not fitted yet, this is equivalent to calling :meth:`fit`.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The new input data.
+
+        y : None
+            This parameter is ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not hasattr(self, "X_fit_"):
+            return self.fit(X, y)
+        if not len(X):
+            return self
+        if len(self.X_fit_) and (
+            isinstance(X[0], dict) != isinstance(self.X_fit_[0], dict)
+        ):
+            raise TypeError(
+                "The new input data should be of the same type as the data used to "
+                f"fit the retriever, got {type(X[0])} instead of "
+                f"{type(self.X_fit_[0])}."
+            )
+        start = time.time()
+        texts = [x["text"] for x in X] if isinstance(X[0], dict) else X
+        vocabulary = getattr(self.count_vectorizer_, "vocabulary_", None)
+        if vocabulary is not None:
+            analyzer = self.count_vectorizer_.build_analyzer()
+            for text in texts:
+                for term in analyzer(text):
+                    vocabulary.setdefault(term, len(vocabulary))
+        X_counts = sparse.csr_matrix(self.count_vectorizer_.transform(texts))
+
+        n_features = X_counts.shape[1]
+        self.X_counts_.resize((self.X_counts_.shape[0], n_features))
+        self.X_counts_ = sparse.vstack([self.X_counts_, X_counts], format="csr")
+        self.n_terms_by_document_ = np.concatenate(
+            [self.n_terms_by_document_, X_counts.sum(axis=1).A1]
+        )
+        # the ids of the removed documents are not reused
+        document_ids = self._get_document_ids()
+        start_id = self._next_document_id
+        self.document_ids_ = np.concatenate(
+            [document_ids, np.arange(start_id, start_id + len(X))]
+        )
+        self._next_document_id = start_id + len(X)
+        n_documents_by_term = self._get_n_documents_by_term()
+        self._n_documents_by_term = np.concatenate(
+            [n_documents_by_term, np.zeros(n_features - len(n_documents_by_term))]
+        )
+        self._n_documents_by_term += X_counts.sum(axis=0).A1
+        # create a new container to not modify in-place the data provided by the user
+        self.X_fit_ = list(self.X_fit_) + list(X)
+        # the idf and the impact are refreshed lazily by `_check_impact`
+        self._impact_params = None
+        logger.info(
+            f"{len(X)} documents added to the BM25Retriever in "
+            f"{time.time() - start:.2f}s"
+        )
         return self
 
-    def query(self, query):
+    @_fit_context(prefer_skip_nested_validation=False)
+    def remove_sources(self, sources):
+        """Remove all the documents coming from some sources.
+
+        The idf and the impact of the terms are refreshed at the next query. The
+        vocabulary is kept as-is.
+
+        Parameters
+        ----------
+        sources : str or list of str
+            The sources of the documents to remove. Unknown sources are ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        check_is_fitted(self, "X_fit_")
+        if isinstance(sources, str):
+            sources = [sources]
+        sources = set(sources)
+        keep = np.array(
+            [
+                not (isinstance(document, dict) and document["source"] in sources)
+                for document in self.X_fit_
+            ]
+        )
+        if keep.all():
+            return self
+
+        start = time.time()
+        self._n_documents_by_term = (
+            self._get_n_documents_by_term() - self.X_counts_[~keep].sum(axis=0).A1
+        )
+        self.X_counts_ = self.X_counts_[keep]
+        self.n_terms_by_document_ = self.n_terms_by_document_[keep]
+        self.document_ids_ = self._get_document_ids()[keep]
+        self.X_fit_ = [document for document, k in zip(self.X_fit_, keep) if k]
+        self._impact_params = None
+        logger.info(
+            f"{np.count_nonzero(~keep)} documents removed from the BM25Retriever "
+            f"in {time.time() - start:.2f}s"
+        )
+        return self
+
+    def upsert(self, X):
+        """Replace the documents of the sources present in `X` by `X`.
+
+        All the documents sharing a source with one of the documents in `X` are
+        removed and the documents in `X` are then added to the retriever. Only the
+        documents in `X` are vectorized.
+
+        Parameters
+        ----------
+        X : list of dict
+            The new documents. They should contain the keys "source" and "text".
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not all(isinstance(document, dict) for document in X):
+            raise TypeError(
+                "upsert requires documents to be dictionaries with a 'source' key."
+            )
+        if hasattr(self, "X_fit_"):
+            self.remove_sources(list({document["source"] for document in X}))
+        return self.partial_fit(X)
+
+    def _compute_impact(self):
+        """Precompute the BM25 score of each term in each document."""
+        X_counts = sparse.csc_matrix(self.X_counts_)
+        term_frequencies = X_counts.data.astype(np.float64)
+        document_normalization = self.k1 * (
+            1
+            - self.b
+            + self.b * self.n_terms_by_document_ / self.averaged_document_length_
+        )
+        terms = np.repeat(np.arange(X_counts.shape[1]), np.diff(X_counts.indptr))
+        impact = (
+            self.idf_[terms]
+            * term_frequencies
+            * (self.k1 + 1)
+            / (term_frequencies + document_normalization[X_counts.indices])
+        )
+        if self.impact_dtype == "uint8":
+            # linear quantization: a matching term always contributes to the score
+            self.impact_scale_ = max(impact.max(initial=0), np.finfo(np.float32).tiny)
+            self.impact_scale_ /= np.iinfo(np.uint8).max
+            impact = np.clip(np.rint(impact / self.impact_scale_), 1, None)
+        else:
+            self.impact_scale_ = 1.0
+        self.impact_ = sparse.csc_matrix(
+            (impact.astype(self.impact_dtype), X_counts.indices, X_counts.indptr),
+            shape=X_counts.shape,
+        )
+        self.max_impact_ = self.impact_.max(axis=0).toarray().ravel()
+        self._impact_params = (self.b, self.k1, self.impact_dtype)
+
+    def _check_impact(self):
+        """Recompute the impact if the parameters or the documents changed since it
+        was computed."""
+        # retrievers pickled before the impact was precomputed do not store it
+        if getattr(self, "_impact_params", None) != (
+            self.b,
+            self.k1,
+            self.impact_dtype,
+        ):
+            self._compute_idf()
+            self._compute_impact()
+
+    def _postings(self, term):
+        """Documents containing a term, in increasing order, and their impacts."""
+        entry = slice(self.impact_.indptr[term], self.impact_.indptr[term + 1])
+        return self.impact_.indices[entry], self.impact_.data[entry]
+
+    def _score(self, query_terms_indices):
+        """Sum the BM25 scores of the query terms in each document.
+
+        Parameters
+        ----------
+        query_terms_indices : ndarray of shape (n_query_terms,)
+            The indices of the terms of the query.
+
+        Returns
+        -------
+        scores : ndarray of shape (n_documents,)
+            The BM25 score of each document.
+        """
+        self._check_impact()
+        # gather the non-zero entries of the columns of the query terms only
+        postings = [self._postings(term) for term in query_terms_indices]
+        if not postings:
+            return np.zeros(self.impact_.shape[0])
+        documents, impacts = zip(*postings)
+        scores = np.bincount(
+            np.concatenate(documents),
+            weights=np.concatenate(impacts),
+            minlength=self.impact_.shape[0],
+        )
+        return scores * self.impact_scale_
+
+    def _score_maxscore(self, query_terms_indices, top_k):
+        """Score the documents that can enter the top-k with MaxScore pruning.
+
+        The terms are processed by decreasing maximum impact, i.e. the rare terms
+        with short postings first. The k-th best partial score is a lower bound of
+        the k-th best final score: once it exceeds the sum of the maximum impacts
+        of the remaining terms, a document not seen yet cannot enter the top-k.
+        The postings of the remaining terms, typically the long postings of the
+        frequent terms, are then only searched for the candidate documents and
+        the candidates that cannot reach the k-th best score are discarded.
+
+        Parameters
+        ----------
+        query_terms_indices : ndarray of shape (n_query_terms,)
+            The indices of the terms of the query.
+
+        top_k : int
+            The number of documents to retrieve.
+
+        Returns
+        -------
+        documents : ndarray of shape (n_candidates,)
+            The candidate documents, a superset of the top-k documents with a
+            non-zero score.
+
+        scores : ndarray of shape (n_candidates,)
+            The BM25 score of the candidate documents.
+        """
+        self._check_impact()
+        max_impact = self.max_impact_[query_terms_indices].astype(np.float64)
+        order = np.argsort(-max_impact, kind="stable")
+        terms = query_terms_indices[order]
+        # maximum score that the terms not processed yet can add to a document
+        remaining_bound = np.append(np.cumsum(max_impact[order][::-1])[::-1], 0)
+
+        # traverse the postings of the terms while new documents can enter the
+        # top-k, accumulating the partial scores of the documents seen so far in
+        # sorted sparse arrays such that the cost does not grow with the corpus
+        documents = np.empty(0, dtype=np.int64)
+        scores = np.empty(0)
+        threshold, n_essential_terms = 0.0, 0
+        while (
+            n_essential_terms < len(terms)
+            and remaining_bound[n_essential_terms] > threshold
+        ):
+            term_documents, term_impacts = self._postings(terms[n_essential_terms])
+            if (
+                len(documents) + len(term_documents)
+                > MAXSCORE_DENSE_FRACTION * self.impact_.shape[0]
+            ):
+                # the postings to traverse cover a large part of the corpus:
+                # scoring all the documents at once is cheaper than merging them
+                scores = self._score(query_terms_indices)
+                return np.arange(len(scores)), scores
+            documents, scores = _merge_postings(
+                documents, scores, term_documents, term_impacts
+            )
+            if len(scores) >= top_k:
+                # the k-th best partial score is a lower bound of the k-th best
+                # final score
+                threshold = np.partition(scores, len(scores) - top_k)[-top_k]
+            n_essential_terms += 1
+
+        keep = (scores > 0) & (scores + remaining_bound[n_essential_terms] >= threshold)
+        documents, scores = documents[keep], scores[keep]
+        # only look up the candidates in the postings of the remaining terms
+        for term_idx in range(n_essential_terms, len(terms)):
+            term_documents, term_impacts = self._postings(terms[term_idx])
+            if not len(term_documents) or not len(documents):
+                continue
+            positions = np.searchsorted(term_documents, documents)
+            positions = np.minimum(positions, len(term_documents) - 1)
+            found = term_documents[positions] == documents
+            scores[found] += term_impacts[positions[found]]
+            if len(scores) > top_k:
+                threshold = np.partition(scores, len(scores) - top_k)[-top_k]
+                keep = scores + remaining_bound[term_idx + 1] >= threshold
+                documents, scores = documents[keep], scores[keep]
+        return documents, scores * self.impact_scale_
+
+    def _top_k(self, query_terms_indices):
+        """Indices and scores of the most relevant documents, by decreasing
+        score."""
+        self._check_impact()
+        n_documents = self.impact_.shape[0]
+        if self.algorithm == "maxscore":
+            documents, scores = self._score_maxscore(
+                query_terms_indices, min(self.top_k, n_documents)
+            )
+        else:  # self.algorithm == "exhaustive"
+            n_shards = min(
+                effective_n_jobs(self.n_jobs), n_documents // SHARD_MIN_DOCUMENTS
+            )
+            if n_shards > 1:
+                return self._top_k_sharded(query_terms_indices, n_shards)
+            scores = self._score(query_terms_indices)
+            documents = np.arange(n_documents)
+        return self._select_top_k(documents, scores)
+
+    def _top_k_sharded(self, query_terms_indices, n_shards):
+        """Indices and scores of the most relevant documents, scoring shards of
+        documents in parallel threads."""
+        postings = [self._postings(term) for term in query_terms_indices]
+        bounds = np.linspace(0, self.impact_.shape[0], n_shards + 1).astype(int)
+        thread_pool = _get_thread_pool(n_shards, name="bm25")
+        shards_top_k = thread_pool.map(
+            lambda shard: self._top_k_shard(postings, *shard),
+            zip(bounds[:-1], bounds[1:]),
+        )
+        # k-way merge of the local top documents, sorted by decreasing score and
+        # increasing position
+        merged = heapq.merge(
+            *[zip(-scores, documents) for documents, scores in shards_top_k]
+        )
+        top_k = min(self.top_k, self.impact_.shape[0])
+        negated_scores, documents = zip(*itertools.islice(merged, top_k))
+        return np.array(documents), -np.array(negated_scores)
+
+    def _top_k_shard(self, postings, start, stop):
+        """Local top documents of the shard of documents from `start` to `stop`."""
+        documents, impacts = [], []
+        for term_documents, term_impacts in postings:
+            entry = slice(*np.searchsorted(term_documents, [start, stop]))
+            documents.append(term_documents[entry])
+            impacts.append(term_impacts[entry])
+        scores = np.bincount(
+            np.concatenate([np.empty(0, dtype=np.int32), *documents]) - start,
+            weights=np.concatenate([np.empty(0), *impacts]),
+            minlength=stop - start,
+        )
+        documents, scores = self._select_top_k(
+            np.arange(stop - start), scores * self.impact_scale_, stop - start
+        )
+        return documents + start, scores
+
+    def _select_top_k(self, documents, scores, n_documents=None):
+        """Select the `top_k` documents with the highest scores.
+
+        Parameters
+        ----------
+        documents : ndarray of shape (n_candidates,)
+            The indices of the scored documents. The documents not listed have a
+            null score.
+
+        scores : ndarray of shape (n_candidates,)
+            The scores of the documents.
+
+        n_documents : int, default=None
+            The number of documents among which the top documents are selected.
+            If None, all the documents of the retriever.
+
+        Returns
+        -------
+        documents : ndarray of shape (top_k,)
+            The indices of the most relevant documents, by decreasing score.
+
+        scores : ndarray of shape (top_k,)
+            The scores of the most relevant documents.
+        """
+        if n_documents is None:
+            n_documents = self.impact_.shape[0]
+        return _select_top_k(documents, scores, self.top_k, n_documents)
+
+    def _top_k_batch(self, queries):
+        """Indices and scores of the most relevant documents of a chunk of
+        queries."""
+        X_queries = self.count_vectorizer_.transform(queries).tocsr()
+        # the score of a document sums the impacts of the distinct query terms
+        X_queries.data = np.ones_like(X_queries.data, dtype=np.float64)
+        scores = (X_queries @ self.impact_.T).tocsr()
+        return [
+            self._select_top_k(
+                scores.indices[scores.indptr[row] : scores.indptr[row + 1]],
+                scores.data[scores.indptr[row] : scores.indptr[row + 1]]
+                * self.impact_scale_,
+            )
+            for row in range(scores.shape[0])
+        ]
+
+    def _get_documents(self, indices, scores, return_result=False):
+        """Map the indices of the documents to the training documents."""
+        if return_result:
+            return RetrievalResult(
+                self._get_document_ids()[indices],
+                scores,
+                self.X_fit_,
+                positions=indices,
+            )
+        return [_format_document(self.X_fit_[neighbor]) for neighbor in indices]
+
+    def query(self, query, *, return_result=False):
         """Retrieve the most relevant documents for the query.
 
         Parameters
@@ -106,9 +747,13 @@ class BM25Retriever(BaseEstimator):
         query : str
             The input data.
 
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` holding the identifiers
+            and the BM25 scores of the documents.
+
         Returns
         -------
-        list of str or dict
+        list of str or dict or :class:`RetrievalResult`
             The list of the most relevant document from the training set.
         """
         check_is_fitted(self, "X_fit_")
@@ -116,28 +761,325 @@ class BM25Retriever(BaseEstimator):
             raise TypeError(f"query should be a string, got {type(query)}.")
         start = time.time()
         query_terms_indices = self.count_vectorizer_.transform([query]).indices
-        counts_query_in_X_fit = self.X_counts_[:, query_terms_indices].toarray()
-        idf = self.idf_[query_terms_indices]
-        numerator = counts_query_in_X_fit * (self.k1 + 1)
-        denominator = counts_query_in_X_fit + self.k1 * (
+        indices, scores = self._top_k(query_terms_indices)
+        logger.info(f"BM25Retriever queried in {time.time() - start:.2f}s")
+        return self._get_documents(indices, scores, return_result)
+
+    def query_batch(self, queries, *, return_result=False):
+        """Retrieve the most relevant documents for several queries at once.
+
+        The queries are vectorized into a sparse matrix scored against all the
+        documents with a sparse matrix product. The queries are scored by chunks
+        spread across `n_jobs` threads. The scores are the ones of the
+        `"exhaustive"` algorithm whatever `algorithm`.
+
+        Parameters
+        ----------
+        queries : list of str
+            The queries.
+
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` for each query holding
+            the identifiers and the BM25 scores of the documents.
+
+        Returns
+        -------
+        list of list of str or dict or list of :class:`RetrievalResult`
+            For each query, the list of the most relevant document from the
+            training set.
+        """
+        check_is_fitted(self, "X_fit_")
+        if isinstance(queries, str) or not all(
+            isinstance(query, str) for query in queries
+        ):
+            raise TypeError(
+                f"queries should be a list of strings, got {type(queries)}."
+            )
+        if not len(queries):
+            return []
+        start = time.time()
+        self._check_impact()
+        queries = list(queries)
+        # scipy releases the GIL in the sparse matrix product
+        results = Parallel(n_jobs=self.n_jobs, prefer="threads")(
+            delayed(self._top_k_batch)(queries[batch])
+            for batch in gen_batches(len(queries), QUERY_CHUNK_SIZE)
+        )
+        logger.info(
+            f"BM25Retriever queried with {len(queries)} queries in "
+            f"{time.time() - start:.2f}s"
+        )
+        return [
+            self._get_documents(indices, scores, return_result)
+            for results_chunk in results
+            for indices, scores in results_chunk
+        ]
+
+
+def _intersect(a, b):
+    """Intersection of two sorted arrays of unique values."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    # look up the values of the smallest array in the largest one
+    indices = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[indices] == a]
+
+
+class PositionalBM25Retriever(BaseEstimator):
+    """Retrieve the k-nearest neighbors using BM25 with phrases matched at query
+    time.
+
+    The unigrams of the documents are indexed with their positions. The n-grams of
+    the query are matched by looking up the consecutive positions of their
+    unigrams in the index, instead of storing every n-gram of the documents in the
+    vocabulary. The scores are the ones of a :class:`BM25Retriever` using the same
+    `count_vectorizer` while the index is several times smaller.
+
+    Parameters
+    ----------
+    count_vectorizer : transformer, default=None
+        A :class:`sklearn.feature_extraction.text.CountVectorizer` with a word
+        analyzer used to tokenize the documents. Its `ngram_range` gives the length
+        of the phrases matched at query time. Only the unigrams are indexed such
+        that the options restricting the vocabulary, e.g. `min_df`, apply to the
+        unigrams. If None, a `CountVectorizer()` is used.
+
+    top_k : int, default=1
+        Number of documents to retrieve.
+
+    b : float, default=0.75
+        Strength of the normalization of the term frequencies by the length of the
+        documents.
+
+    k1 : float, default=1.6
+        Saturation of the term frequencies.
+
+    Attributes
+    ----------
+    X_fit_ : list of str or dict
+        The input data.
+
+    count_vectorizer_ : transformer
+        The count vectorizer used to build the vocabulary of unigrams.
+
+    ngram_range_ : tuple of int
+        The range of length of the phrases matched at query time.
+
+    postings_ : ndarray of shape (n_tokens,)
+        The positions of the unigrams in the documents, grouped by unigram and
+        sorted. A position is encoded as `document * position_stride_ + offset`
+        where `offset` is the index of the token in the document.
+
+    postings_indptr_ : ndarray of shape (n_features + 1,)
+        The positions of the unigram `i` are
+        `postings_[postings_indptr_[i]:postings_indptr_[i + 1]]`.
+
+    position_stride_ : int
+        The stride between the positions of two consecutive documents.
+
+    n_terms_by_document_ : ndarray of shape (n_documents,)
+        The number of n-grams by document.
+
+    averaged_document_length_ : float
+        The average number of n-grams by document.
+
+    idf_ : ndarray of shape (n_features,)
+        The inverse document frequency of the unigrams. The phrases more
+        frequent than the documents are given a fourth of its mean as inverse
+        document frequency. It is the same as :class:`BM25Retriever` when only
+        the unigrams are matched and an approximation otherwise since the mean
+        would run over all n-grams.
+    """
+
+    _parameter_constraints = {
+        "count_vectorizer": [HasMethods(["fit", "build_analyzer"]), None],
+        "top_k": [Interval(Integral, left=1, right=None, closed="left")],
+        "b": [Interval(Real, left=0, right=1, closed="both")],
+        "k1": [Interval(Real, left=0, right=None, closed="left")],
+    }
+
+    def __init__(self, *, count_vectorizer=None, top_k=1, b=0.75, k1=1.6):
+        self.count_vectorizer = count_vectorizer
+        self.top_k = top_k
+        self.b = b
+        self.k1 = k1
+
+    @_fit_context(prefer_skip_nested_validation=False)
+    def fit(self, X, y=None):
+        """Index the positions of the unigrams.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The input data.
+
+        y : None
+            This parameter is ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        self.X_fit_ = X
+
+        if isinstance(X[0], dict):
+            X = [x["text"] for x in X]
+
+        start = time.time()
+        if self.count_vectorizer is None:
+            count_vectorizer = CountVectorizer()
+        else:
+            count_vectorizer = clone(self.count_vectorizer)
+        if count_vectorizer.analyzer != "word":
+            raise ValueError(
+                "The count_vectorizer should use a word analyzer to match phrases, "
+                f"got analyzer={count_vectorizer.analyzer!r}."
+            )
+        self.ngram_range_ = count_vectorizer.ngram_range
+        self.count_vectorizer_ = count_vectorizer.set_params(ngram_range=(1, 1))
+        self.count_vectorizer_.fit(X)
+
+        analyzer = self.count_vectorizer_.build_analyzer()
+        vocabulary = self.count_vectorizer_.vocabulary_
+        documents_terms = [
+            np.array([vocabulary.get(token, -1) for token in analyzer(x)], dtype=int)
+            for x in X
+        ]
+        n_tokens_by_document = np.array([len(terms) for terms in documents_terms])
+        # the gap between two documents is larger than the longest phrase such
+        # that a phrase cannot span two documents
+        self.position_stride_ = int(n_tokens_by_document.max(initial=0))
+        self.position_stride_ += self.ngram_range_[1]
+
+        terms = np.concatenate([np.empty(0, dtype=int), *documents_terms])
+        positions = np.arange(len(terms)) - np.repeat(
+            np.cumsum(n_tokens_by_document) - n_tokens_by_document,
+            n_tokens_by_document,
+        )
+        positions += self.position_stride_ * np.repeat(
+            np.arange(len(X)), n_tokens_by_document
+        )
+        # drop the tokens out of the vocabulary while keeping their positions
+        indexed = terms >= 0
+        terms, positions = terms[indexed], positions[indexed]
+        order = np.lexsort((positions, terms))
+        self.postings_ = positions[order]
+        self.postings_indptr_ = np.concatenate(
+            [[0], np.cumsum(np.bincount(terms, minlength=len(vocabulary)))]
+        )
+
+        min_n, max_n = self.ngram_range_
+        self.n_terms_by_document_ = sum(
+            np.maximum(n_tokens_by_document - n + 1, 0) for n in range(min_n, max_n + 1)
+        )
+        self.averaged_document_length_ = self.n_terms_by_document_.mean()
+        n_occurrences = np.diff(self.postings_indptr_)
+        self.idf_ = self._idf(n_occurrences)
+        self._idf_floor = 0.25 * np.mean(self.idf_)
+        self.idf_[self.idf_ < 0] = self._idf_floor
+
+        logger.info(f"PositionalBM25Retriever fitted in {time.time() - start:.2f}s")
+        return self
+
+    def _idf(self, n_occurrences):
+        """Inverse document frequency of terms occurring `n_occurrences` times."""
+        n_documents = len(self.X_fit_)
+        return np.log((n_documents - n_occurrences + 0.5) / (n_occurrences + 0.5) + 1)
+
+    def _postings(self, term):
+        """Positions of a unigram in the documents, in increasing order."""
+        return self.postings_[
+            self.postings_indptr_[term] : self.postings_indptr_[term + 1]
+        ]
+
+    def _score(self, query):
+        """Sum the BM25 scores of the phrases of the query in each document.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+
+        Returns
+        -------
+        scores : ndarray of shape (n_documents,)
+            The BM25 score of each document.
+        """
+        analyzer = self.count_vectorizer_.build_analyzer()
+        vocabulary = self.count_vectorizer_.vocabulary_
+        terms = [vocabulary.get(token, -1) for token in analyzer(query)]
+        min_n, max_n = self.ngram_range_
+        document_normalization = self.k1 * (
             1
             - self.b
-            + self.b
-            * (
-                self.n_terms_by_document_.reshape(-1, 1)
-                / self.averaged_document_length_
-            )
+            + self.b * self.n_terms_by_document_ / self.averaged_document_length_
         )
-        scores = (idf * numerator / denominator).sum(axis=1)
-        indices = scores.argsort()[::-1][: self.top_k]
-        logger.info(f"BM25Retriever queried in {time.time() - start:.2f}s")
-        if isinstance(self.X_fit_[0], dict):
-            return [
-                {
-                    "source": self.X_fit_[neighbor]["source"],
-                    "text": self.X_fit_[neighbor]["text"],
-                }
-                for neighbor in indices
-            ]
-        else:  # isinstance(self.X_fit_[0], str)
-            return [self.X_fit_[neighbor] for neighbor in indices]
+        scores = np.zeros(len(self.n_terms_by_document_))
+        scored_phrases = set()
+        for first in range(len(terms)):
+            # extend the phrase starting at `first` one token at a time: the
+            # occurrences of a phrase are the occurrences of its prefix followed
+            # by its last token
+            starts = None
+            for n in range(1, min(max_n, len(terms) - first) + 1):
+                term = terms[first + n - 1]
+                if term < 0:
+                    break
+                term_starts = self._postings(term) - (n - 1)
+                starts = term_starts if n == 1 else _intersect(starts, term_starts)
+                if not len(starts):
+                    break
+                phrase = tuple(terms[first : first + n])
+                if n < min_n or phrase in scored_phrases:
+                    continue
+                scored_phrases.add(phrase)
+
+                idf = self._idf(len(starts))
+                if idf < 0:
+                    idf = self._idf_floor
+                # the positions are sorted: count the runs of each document
+                documents = starts // self.position_stride_
+                run_starts = np.flatnonzero(np.diff(documents, prepend=-1))
+                term_frequencies = np.diff(run_starts, append=len(documents))
+                documents = documents[run_starts]
+                scores[documents] += (
+                    idf
+                    * term_frequencies
+                    * (self.k1 + 1)
+                    / (term_frequencies + document_normalization[documents])
+                )
+        return scores
+
+    def query(self, query, *, return_result=False):
+        """Retrieve the most relevant documents for the query.
+
+        Parameters
+        ----------
+        query : str
+            The input data.
+
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` holding the positions of
+            the documents in `X_fit_` as identifiers and their BM25 scores.
+
+        Returns
+        -------
+        list of str or dict or :class:`RetrievalResult`
+            The list of the most relevant document from the training set.
+        """
+        check_is_fitted(self, "X_fit_")
+        if not isinstance(query, str):
+            raise TypeError(f"query should be a string, got {type(query)}.")
+        start = time.time()
+        scores = self._score(query)
+        # same selection and tie-breaking as BM25Retriever
+        indices, scores = _select_top_k(
+            np.arange(len(scores)), scores, self.top_k, len(scores)
+        )
+        logger.info(f"PositionalBM25Retriever queried in {time.time() - start:.2f}s")
+        if return_result:
+            return RetrievalResult(indices, scores, self.X_fit_, positions=indices)
+        return [_format_document(self.X_fit_[neighbor]) for neighbor in indices]
@@ -1,8 +1,13 @@
+import inspect
 from numbers import Integral, Real
 
+from joblib import effective_n_jobs
 from sklearn.base import BaseEstimator, _fit_context
 from sklearn.utils._param_validation import HasMethods, Interval
 
+from ._result import RetrievalResult
+from ._utils import _get_thread_pool
+
 
 class RetrieverReranker(BaseEstimator):
     """Hybrid retriever (lexical and semantic) followed by a cross-encoder reranker.
@@ -14,7 +19,9 @@ class RetrieverReranker(BaseEstimator):
     ----------
     retrievers : list of retriever instances
         The retrievers to use for retrieving the context. We expect the retrievers to
-        implement a `query` method.
+        implement a `query` method. When it accepts a `return_result` parameter,
+        the retrieved documents are only formatted once selected by the
+        cross-encoder.
 
     cross_encoder : :class:`~sentence_transformers.cross_encoder.CrossEncoder`
         Cross-encoder used to rerank the results of the hybrid retriever.
@@ -34,6 +41,16 @@ class RetrieverReranker(BaseEstimator):
     drop_duplicates : bool, default=True
         Whether to drop duplicates from the retrieved documents. This step is done
         right after the retrieval step.
+
+    n_jobs : int, default=None
+        Number of threads used to query the retrievers concurrently. The
+        retrievers mostly release the GIL while searching, e.g. for the encoding
+        of the query and the FAISS search, such that the retrieval takes about
+        the time of the slowest retriever instead of the sum of their times. The
+        threads are reused across queries and the documents are gathered in the
+        order of `retrievers` whatever the number of threads. `None` means 1
+        unless in a :obj:`joblib.parallel_config` context. `-1` means using all
+        processors, with at most one thread per retriever.
     """
 
     _parameter_constraints = {
@@ -43,6 +60,7 @@ class RetrieverReranker(BaseEstimator):
         "max_top_k": [Interval(Integral, left=0, right=None, closed="left"), None],
         "threshold": [Real, None],
         "drop_duplicates": [bool],
+        "n_jobs": [Integral, None],
     }
 
     def __init__(
@@ -54,6 +72,7 @@ class RetrieverReranker(BaseEstimator):
         max_top_k=None,
         threshold=None,
         drop_duplicates=True,
+        n_jobs=None,
     ):
         self.retrievers = retrievers
         self.cross_encoder = cross_encoder
@@ -61,6 +80,7 @@ class RetrieverReranker(BaseEstimator):
         self.max_top_k = max_top_k
         self.threshold = threshold
         self.drop_duplicates = drop_duplicates
+        self.n_jobs = n_jobs
 
     @_fit_context(prefer_skip_nested_validation=False)
     def fit(self, X=None, y=None):
@@ -87,6 +107,13 @@ class RetrieverReranker(BaseEstimator):
             return search["text"]
         return search
 
+    @staticmethod
+    def _query_retriever(retriever, query):
+        """Query a retriever, as a :class:`RetrievalResult` when supported."""
+        if "return_result" in inspect.signature(retriever.query).parameters:
+            return retriever.query(query, return_result=True)
+        return retriever.query(query)
+
     def query(self, query):
         """Retrieve the most relevant documents for the query.
 
@@ -100,26 +127,44 @@ class RetrieverReranker(BaseEstimator):
         list of str or dict
             The list of the most relevant document from the training set.
         """
-        unranked_search = []
-        for retriever in self.retrievers:
-            unranked_search += retriever.query(query)
+        # the retrieved documents as (results of a retriever, position) with their
+        # text, the documents being only formatted once selected
+        n_threads = min(effective_n_jobs(self.n_jobs), len(self.retrievers))
+        if n_threads > 1:
+            # `map` gathers the results in the order of the retrievers
+            searches = _get_thread_pool(n_threads, name="retriever").map(
+                lambda retriever: self._query_retriever(retriever, query),
+                self.retrievers,
+            )
+        else:
+            searches = (
+                self._query_retriever(retriever, query) for retriever in self.retrievers
+            )
+
+        unranked_search, contexts = [], []
+        for search in searches:
+            if isinstance(search, RetrievalResult):
+                search_contexts = search.texts
+            else:
+                search_contexts = [self._get_context(document) for document in search]
+            unranked_search += [(search, idx) for idx in range(len(search))]
+            contexts += search_contexts
 
         if not unranked_search:
             return []
 
         if self.drop_duplicates:
-            filtered_unranked_search = []
+            filtered_unranked_search, filtered_contexts = [], []
             chunk_already_seen = set()
-            for search in unranked_search:
-                if self._get_context(search) in chunk_already_seen:
+            for search, context in zip(unranked_search, contexts):
+                if context in chunk_already_seen:
                     continue
-                chunk_already_seen.add(self._get_context(search))
+                chunk_already_seen.add(context)
                 filtered_unranked_search.append(search)
-            unranked_search = filtered_unranked_search
+                filtered_contexts.append(context)
+            unranked_search, contexts = filtered_unranked_search, filtered_contexts
 
-        merged_search = [
-            (query, self._get_context(search)) for search in unranked_search
-        ]
+        merged_search = [(query, context) for context in contexts]
         scores = self.cross_encoder.predict(merged_search)
         indices = scores.argsort()[::-1]
         sorted_scores = scores[indices]
@@ -136,7 +181,10 @@ class RetrieverReranker(BaseEstimator):
             ):
                 indices_thresholded = indices[: self.max_top_k]
 
-        return [unranked_search[idx] for idx in indices_thresholded]
+        return [
+            unranked_search[idx][0][unranked_search[idx][1]]
+            for idx in indices_thresholded
+        ]
 
     def _more_tags(self):
         return {"stateless": True}
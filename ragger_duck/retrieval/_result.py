@@ -0,0 +1,100 @@
+"""Structured results of the retrievers."""
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def _format_document(document):
+    """Format a training document as returned by the retrievers."""
+    if isinstance(document, dict):
+        return {"source": document["source"], "text": document["text"]}
+    return document
+
+
+class RetrievalResult(Sequence):
+    """Documents retrieved for a query, with their identifiers and scores.
+
+    A result is returned by the `query` method of the retrievers when called with
+    `return_result=True`. It behaves as the list of documents returned by
+    default: indexing or iterating over it gives the documents as
+    `{"source", "text"}` dicts or strings. The result only holds a reference to
+    the documents of the retriever and the positions of the retrieved documents
+    such that the documents are only formatted when they are accessed.
+
+    Parameters
+    ----------
+    ids : array-like of shape (n_retrieved,)
+        The identifiers of the retrieved documents within the retriever.
+
+    scores : array-like of shape (n_retrieved,)
+        The relevance scores of the retrieved documents, the higher the more
+        relevant. The scores are only comparable between documents retrieved by
+        the same retriever.
+
+    documents : sequence of str or dict
+        The documents of the retriever.
+
+    positions : array-like of shape (n_retrieved,), default=None
+        The positions of the retrieved documents in `documents`. If None,
+        `documents` are the retrieved documents.
+
+    Attributes
+    ----------
+    ids : ndarray of shape (n_retrieved,)
+        The identifiers of the retrieved documents within the retriever.
+
+    scores : ndarray of shape (n_retrieved,)
+        The relevance scores of the retrieved documents.
+    """
+
+    def __init__(self, ids, scores, documents, positions=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.scores = np.asarray(scores)
+        self._documents = documents
+        if positions is None:
+            positions = np.arange(len(self.ids))
+        self._positions = np.asarray(positions, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RetrievalResult(
+                self.ids[index],
+                self.scores[index],
+                self._documents,
+                positions=self._positions[index],
+            )
+        return _format_document(self._documents[self._positions[index]])
+
+    def __repr__(self):
+        return f"RetrievalResult(ids={self.ids!r}, scores={self.scores!r})"
+
+    def _field(self, key):
+        """Value of a key of each retrieved document, None for missing keys."""
+        values = []
+        for position in self._positions:
+            document = self._documents[position]
+            if isinstance(document, dict):
+                values.append(document.get(key))
+            else:
+                values.append(document if key == "text" else None)
+        return values
+
+    @property
+    def texts(self):
+        """list of str: The texts of the retrieved documents."""
+        return self._field("text")
+
+    @property
+    def sources(self):
+        """list of str: The sources of the retrieved documents, None when the
+        documents are strings."""
+        return self._field("source")
+
+    @property
+    def corpus(self):
+        """ndarray of shape (n_retrieved,): The corpus of the retrieved documents,
+        None when the documents are not tagged with a corpus."""
+        return np.asarray(self._field("corpus"), dtype=object)
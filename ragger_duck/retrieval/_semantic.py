@@ -1,14 +1,90 @@
 import logging
 import time
+from copy import copy
+from math import sqrt
 from numbers import Integral
+from pathlib import Path
 
 import faiss
-from sklearn.base import BaseEstimator, _fit_context
-from sklearn.utils._param_validation import HasMethods, Interval
+import joblib
+import numpy as np
+from sklearn.base import BaseEstimator, _fit_context, clone
+from sklearn.utils import check_random_state
+from sklearn.utils._param_validation import HasMethods, Interval, StrOptions
 from sklearn.utils.validation import check_is_fitted
 
+from ._result import RetrievalResult, _format_document
+
 logger = logging.getLogger(__name__)
 
+# Size of the corpus below which an exact search is cheap enough when
+# `index_type="auto"`. Between this size and `HNSW_INDEX_MAX_SIZE`, an HNSW graph
+# is used and an IVF index above.
+FLAT_INDEX_MAX_SIZE = 50_000
+HNSW_INDEX_MAX_SIZE = 1_000_000
+# Maximum number of training points per centroid used by FAISS when training an
+# IVF index or a product quantizer. We subsample the training set to this size to
+# speed-up the training.
+MAX_POINTS_PER_CENTROID = 256
+# Number of bits used to encode each sub-vector with the product quantizer.
+PQ_N_BITS = 8
+# Number of documents decoded at once when searching a subset of the documents of
+# a flat PQ index, which does not support FAISS selectors.
+PQ_SUBSET_CHUNK_SIZE = 16_384
+
+
+# Name of the files created by `SemanticRetriever.save`
+ESTIMATOR_FILENAME = "retriever.joblib"
+INDEX_FILENAME = "index.faiss"
+EMBEDDING_FILENAME = "X_embedded.npy"
+# Factor by which the number of documents retrieved with a single search is
+# increased when serving per-corpus quotas, such that most quotas are filled
+# without searching each corpus separately.
+CORPUS_OVERFETCH_FACTOR = 2
+
+
+def _make_selector(ids):
+    """Create a FAISS selector restricting a search to some documents.
+
+    A range selector is used when the identifiers are contiguous, e.g. the
+    documents of a corpus added at once, and a bitmap otherwise.
+
+    Parameters
+    ----------
+    ids : ndarray of shape (n_selected,)
+        The sorted identifiers of the selected documents.
+
+    Returns
+    -------
+    selector : :class:`faiss.IDSelector`
+        The selector.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids[-1] - ids[0] + 1 == len(ids):
+        return faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    mask = np.zeros(ids[-1] + 1, dtype=bool)
+    mask[ids] = True
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    # the selector does not own the bitmap
+    selector.referenced_objects = [bitmap]
+    return selector
+
+
+def _compile_condition(condition):
+    """Create the predicate matching a metadata value against a filter condition."""
+    if callable(condition):
+        return condition
+    if isinstance(condition, (list, tuple, set, frozenset)):
+        values = set(condition)
+        return lambda value: value in values
+    return lambda value: value == condition
+
+
+def _as_float32(X):
+    """FAISS only accepts C-contiguous float32 arrays."""
+    return np.ascontiguousarray(X, dtype=np.float32)
+
 
 class SemanticRetriever(BaseEstimator):
     """Retrieve the k-nearest neighbors using a semantic embedding.
@@ -20,29 +96,539 @@ class SemanticRetriever(BaseEstimator):
     embedding : transformer
         An embedding following the scikit-learn transformer API.
 
-    top_k : int, default=1
-        Number of documents to retrieve.
+    top_k : int or dict of str to int, default=1
+        Number of documents to retrieve. If a dict, it maps a corpus to the number
+        of documents to retrieve from this corpus. The documents should then be
+        dictionaries with a key "corpus" identifying their corpus: several corpora
+        are held in a single index such that a query is embedded and searched once
+        for all the corpora. The documents are returned corpus by corpus, in the
+        order of the dict.
+
+    projection : transformer, default=None
+        A transformer reducing the dimension of the embedding, e.g.
+        :class:`~ragger_duck.embedding.EmbeddingProjection`. It is cloned and
+        fitted on the embedded documents during `fit` and then applied to the
+        embedded documents and queries. If None, the embedding is indexed as is.
+
+    index_type : {"auto", "flat", "ivf", "hnsw"}, default="auto"
+        Type of FAISS index used to retrieve the nearest neighbors:
+
+        - `"flat"`: exact search by brute-force;
+        - `"ivf"`: approximate search using an inverted file index where the
+          vectors are partitioned into `n_lists` clusters;
+        - `"hnsw"`: approximate search using a Hierarchical Navigable Small World
+          graph;
+        - `"auto"`: `"flat"` for corpus smaller than 50,000 documents, `"hnsw"` for
+          corpus smaller than 1,000,000 documents and `"ivf"` otherwise.
+
+    n_lists : int, default=None
+        Number of clusters of the IVF index. If None, it is set to
+        `4 * sqrt(n_documents)`. Only used when the IVF index is used.
+
+    n_probe : int, default=8
+        Number of clusters of the IVF index visited at query time. It can be changed
+        after fitting without rebuilding the index. Only used when the IVF index is
+        used.
+
+    hnsw_m : int, default=32
+        Number of neighbors of each node in the HNSW graph. Only used when the HNSW
+        index is used.
+
+    ef_search : int, default=64
+        Size of the candidate list explored in the HNSW graph at query time. It can be
+        changed after fitting without rebuilding the index. Only used when the HNSW
+        index is used.
+
+    codec : {"flat", "fp16", "bf16", "sq8", "pq"}, default="flat"
+        Encoding of the vectors stored in the index:
+
+        - `"flat"`: the vectors are stored in full precision;
+        - `"fp16"`: the vectors are stored as half-precision floats, reducing the
+          memory by 2x;
+        - `"bf16"`: the vectors are stored as bfloat16 floats, reducing the memory
+          by 2x with a wider range but a lower precision than `"fp16"`;
+        - `"sq8"`: each component of the vectors is quantized on 8 bits, reducing
+          the memory by 4x;
+        - `"pq"`: the vectors are compressed with a product quantizer using `pq_m`
+          sub-quantizers of 8 bits each, reducing the memory by
+          `4 * n_features / pq_m`.
+
+    pq_m : int, default=None
+        Number of sub-quantizers of the product quantizer. It should divide the
+        number of features of the embedding. If None, the largest divisor of the
+        number of features lower than `n_features / 4` is used, i.e. a 16x memory
+        reduction for common embedding sizes. Only used when `codec="pq"`.
+
+    rescore_factor : int, default=None
+        When compressing the vectors, retrieve `rescore_factor * top_k` candidates
+        from the compressed index and rescore them with the exact inner product to
+        keep the `top_k` best documents. This requires to keep the vectors in full
+        precision within the index. If None, no rescoring is done. Only used when
+        `codec` is not `"flat"`.
+
+    random_state : int, RandomState instance or None, default=None
+        Control the subsampling of the embedded documents used to train the IVF
+        index and the product quantizer.
 
     Attributes
     ----------
     X_fit_ : list of str or dict
         The input data.
 
-    X_embedded_ : ndarray of shape (n_sentences, n_features)
-        The embedded data.
+    projection_ : transformer or None
+        The fitted `projection`. None if `projection` is None.
+
+    X_embedded_ : ndarray of shape (n_sentences, n_features) or None
+        The embedded data, after the projection. None when `codec` is not
+        `"flat"` since the vectors are only stored, compressed, within the index.
 
     index_ : faiss index
-        The index to retrieve the k-nearest neighbors.
+        The index to retrieve the k-nearest neighbors. The documents are indexed
+        with the identifiers stored in `document_ids_`: the index is wrapped into a
+        :class:`faiss.IndexIDMap2`, except for the IVF index that natively stores
+        the identifiers.
+
+    document_ids_ : ndarray of shape (n_documents,)
+        Stable identifiers of the documents in `X_fit_`, in increasing order.
+        These identifiers are not reused when documents are removed.
+
+    source_to_ids_ : dict of str to list of int
+        Mapping from the source of the documents to the identifiers of the
+        documents of this source. Empty when `X_fit_` is a list of str.
+
+    corpus_to_ids_ : dict of str to list of int
+        Mapping from the corpus of the documents to the identifiers of the
+        documents of this corpus. Empty when the documents have no "corpus" key.
+
+    index_type_ : {"flat", "ivf", "hnsw"}
+        The type of index used. It differs from `index_type` only when
+        `index_type="auto"`.
     """
 
     _parameter_constraints = {
         "embedding": [HasMethods(["fit_transform", "transform"])],
-        "top_k": [Interval(Integral, left=1, right=None, closed="left")],
+        "top_k": [Interval(Integral, left=1, right=None, closed="left"), dict],
+        "projection": [HasMethods(["fit", "transform"]), None],
+        "index_type": [StrOptions({"auto", "flat", "ivf", "hnsw"})],
+        "n_lists": [Interval(Integral, left=1, right=None, closed="left"), None],
+        "n_probe": [Interval(Integral, left=1, right=None, closed="left")],
+        "hnsw_m": [Interval(Integral, left=2, right=None, closed="left")],
+        "ef_search": [Interval(Integral, left=1, right=None, closed="left")],
+        "codec": [StrOptions({"flat", "fp16", "bf16", "sq8", "pq"})],
+        "pq_m": [Interval(Integral, left=1, right=None, closed="left"), None],
+        "rescore_factor": [Interval(Integral, left=1, right=None, closed="left"), None],
+        "random_state": ["random_state"],
     }
 
-    def __init__(self, *, embedding, top_k=1):
+    def __init__(
+        self,
+        *,
+        embedding,
+        top_k=1,
+        projection=None,
+        index_type="auto",
+        n_lists=None,
+        n_probe=8,
+        hnsw_m=32,
+        ef_search=64,
+        codec="flat",
+        pq_m=None,
+        rescore_factor=None,
+        random_state=None,
+    ):
         self.embedding = embedding
         self.top_k = top_k
+        self.projection = projection
+        self.index_type = index_type
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.codec = codec
+        self.pq_m = pq_m
+        self.rescore_factor = rescore_factor
+        self.random_state = random_state
+
+    def _build_index(self, X_embedded):
+        """Create and train the FAISS index.
+
+        Parameters
+        ----------
+        X_embedded : ndarray of shape (n_sentences, n_features)
+            The embedded data.
+
+        Returns
+        -------
+        index : faiss index
+            The empty index mapping the documents with their identifiers.
+        """
+        n_documents, n_features = X_embedded.shape
+        if self.index_type == "auto":
+            if n_documents < FLAT_INDEX_MAX_SIZE:
+                self.index_type_ = "flat"
+            elif n_documents < HNSW_INDEX_MAX_SIZE:
+                self.index_type_ = "hnsw"
+            else:
+                self.index_type_ = "ivf"
+        else:
+            self.index_type_ = self.index_type
+
+        # number of centroids of the k-means trained by FAISS, used to bound the
+        # size of the training set
+        n_centroids = 0
+        if self.codec == "pq":
+            if self.pq_m is None:
+                pq_m = next(
+                    m
+                    for m in range(max(1, n_features // 4), 0, -1)
+                    if n_features % m == 0
+                )
+            elif n_features % self.pq_m != 0:
+                raise ValueError(
+                    f"pq_m={self.pq_m} should divide the number of features of the "
+                    f"embedding ({n_features})."
+                )
+            else:
+                pq_m = self.pq_m
+            # the k-means of each sub-quantizer cannot have more centroids than
+            # documents
+            n_bits = max(1, min(PQ_N_BITS, n_documents.bit_length() - 1))
+            n_centroids = 2**n_bits
+            encoding = f"PQ{pq_m}x{n_bits}"
+        elif self.codec == "sq8":
+            encoding = "SQ8"
+        elif self.codec == "fp16":
+            encoding = "SQfp16"
+        elif self.codec == "bf16":
+            encoding = "SQbf16"
+        else:  # self.codec == "flat"
+            encoding = "Flat"
+
+        if self.index_type_ == "ivf":
+            n_lists = (
+                self.n_lists if self.n_lists is not None else 4 * sqrt(n_documents)
+            )
+            # we cannot have more clusters than documents
+            n_lists = max(1, min(int(n_lists), n_documents))
+            n_centroids = max(n_centroids, n_lists)
+            index_description = f"IVF{n_lists},{encoding}"
+        elif self.index_type_ == "hnsw":
+            index_description = f"HNSW{self.hnsw_m},{encoding}"
+        else:  # self.index_type_ == "flat"
+            index_description = encoding
+        if self.codec != "flat" and self.rescore_factor is not None:
+            index_description += ",RFlat"
+        index = faiss.index_factory(
+            n_features, index_description, faiss.METRIC_INNER_PRODUCT
+        )
+
+        if not index.is_trained:
+            X_train = X_embedded
+            max_train_size = MAX_POINTS_PER_CENTROID * n_centroids
+            if n_centroids and n_documents > max_train_size:
+                random_state = check_random_state(self.random_state)
+                subsample = random_state.choice(
+                    n_documents, size=max_train_size, replace=False
+                )
+                X_train = X_embedded[subsample]
+            index.train(_as_float32(X_train))
+        if isinstance(index, faiss.IndexIVF):
+            # IVF indices natively store the identifiers of the documents
+            return index
+        return faiss.IndexIDMap2(index)
+
+    def _get_base_index(self):
+        """Return the index storing the vectors, without the identifier mapping."""
+        if isinstance(self.index_, faiss.IndexIDMap):
+            return faiss.downcast_index(self.index_.index)
+        return self.index_
+
+    def _add(self, X, X_embedded):
+        """Add documents to the index and assign them new identifiers.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The documents.
+
+        X_embedded : ndarray of shape (n_documents, n_features)
+            The embedded documents.
+        """
+        start_id = self.document_ids_[-1] + 1 if len(self.document_ids_) else 0
+        ids = np.arange(start_id, start_id + len(X), dtype=np.int64)
+        self.index_.add_with_ids(_as_float32(X_embedded), ids)
+        self.document_ids_ = np.concatenate([self.document_ids_, ids])
+        for document_id, document in zip(ids, X):
+            if isinstance(document, dict):
+                self.source_to_ids_.setdefault(document["source"], []).append(
+                    int(document_id)
+                )
+                if "corpus" in document:
+                    self.corpus_to_ids_.setdefault(document["corpus"], []).append(
+                        int(document_id)
+                    )
+
+    def _embed(self, X):
+        """Embed documents or queries and project them with the fitted projection."""
+        X_embedded = self.embedding.transform(X)
+        if self.projection_ is not None:
+            X_embedded = self.projection_.transform(X_embedded)
+        return X_embedded
+
+    def _search(self, X_embedded, k, ids=None):
+        """Search the index with the query-time parameters of the estimator.
+
+        Parameters
+        ----------
+        X_embedded : ndarray of shape (n_queries, n_features)
+            The embedded queries.
+
+        k : int
+            The number of documents to retrieve.
+
+        ids : ndarray of shape (n_selected,), default=None
+            The sorted identifiers of the documents to search. They are compiled
+            into a FAISS selector. If None, all the documents are searched.
+
+        Returns
+        -------
+        distances : ndarray of shape (n_queries, k)
+            The inner products between the queries and the retrieved documents.
+
+        indices : ndarray of shape (n_queries, k)
+            The identifiers of the retrieved documents. -1 is used when less than
+            `k` documents are found.
+        """
+        if ids is not None and self.index_type_ == "flat":
+            code_index = self._get_base_index()
+            if isinstance(code_index, faiss.IndexRefine):
+                code_index = faiss.downcast_index(code_index.base_index)
+            if isinstance(code_index, faiss.IndexPQ):
+                return self._search_subset(X_embedded, k, ids)
+
+        selector_params = {} if ids is None else {"sel": _make_selector(ids)}
+        if self.index_type_ == "ivf":
+            params = faiss.SearchParametersIVF(nprobe=self.n_probe, **selector_params)
+        elif self.index_type_ == "hnsw":
+            params = faiss.SearchParametersHNSW(
+                efSearch=self.ef_search, **selector_params
+            )
+        elif ids is not None:  # self.index_type_ == "flat"
+            params = faiss.SearchParameters(**selector_params)
+        else:
+            params = None
+        if isinstance(self._get_base_index(), faiss.IndexRefine):
+            k_factor = self.rescore_factor if self.rescore_factor is not None else 1
+            params = faiss.IndexRefineSearchParameters(
+                k_factor=k_factor, base_index_params=params, **selector_params
+            )
+        return self.index_.search(_as_float32(X_embedded), k, params=params)
+
+    def _search_subset(self, X_embedded, k, ids):
+        """Exhaustive search restricted to some documents of the index.
+
+        FAISS selectors are not supported by the flat PQ index. Instead, the
+        selected documents are reconstructed by chunks and scored with the
+        queries. The scores are the ones of a PQ search since the inner product
+        with the codes is the inner product with the reconstructed documents;
+        they are exact when the index holds full-precision vectors for
+        rescoring.
+
+        Parameters
+        ----------
+        X_embedded : ndarray of shape (n_queries, n_features)
+            The embedded queries.
+
+        k : int
+            The number of documents to retrieve.
+
+        ids : ndarray of shape (n_selected,)
+            The sorted identifiers of the documents to search.
+
+        Returns
+        -------
+        distances : ndarray of shape (n_queries, k)
+            The inner products between the queries and the retrieved documents.
+
+        indices : ndarray of shape (n_queries, k)
+            The identifiers of the retrieved documents. -1 is used when less than
+            `k` documents are found.
+        """
+        X_embedded = _as_float32(X_embedded)
+        ids = np.asarray(ids, dtype=np.int64)
+        distances = np.full((len(X_embedded), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(X_embedded), k), -1, dtype=np.int64)
+        for start in range(0, len(ids), PQ_SUBSET_CHUNK_SIZE):
+            chunk_ids = ids[start : start + PQ_SUBSET_CHUNK_SIZE]
+            chunk_distances = X_embedded @ self.index_.reconstruct_batch(chunk_ids).T
+            # merge the best documents found so far with the ones of the chunk,
+            # by decreasing score and increasing identifier on ties
+            candidate_distances = np.hstack([distances, chunk_distances])
+            candidate_indices = np.hstack(
+                [indices, np.broadcast_to(chunk_ids, chunk_distances.shape)]
+            )
+            order = np.argsort(-candidate_distances, axis=1, kind="stable")[:, :k]
+            distances = np.take_along_axis(candidate_distances, order, axis=1)
+            indices = np.take_along_axis(candidate_indices, order, axis=1)
+        return distances, indices
+
+    def _filter_ids(self, filter):
+        """Identifiers of the documents whose metadata match a filter.
+
+        Parameters
+        ----------
+        filter : dict
+            Mapping from a key of the documents to a condition on its value.
+
+        Returns
+        -------
+        ids : ndarray of shape (n_selected,)
+            The sorted identifiers of the matching documents.
+        """
+        if not isinstance(filter, dict):
+            raise TypeError(f"filter should be a dict, got {type(filter)}.")
+        mapping = {"source": self.source_to_ids_, "corpus": self.corpus_to_ids_}
+        ids = self.document_ids_
+        for key, condition in filter.items():
+            if key in mapping:
+                # the conditions on the sources and the corpora are resolved with
+                # the mappings maintained at fit: a predicate is only evaluated
+                # once per distinct value and not once per document
+                if callable(condition):
+                    values = [value for value in mapping[key] if condition(value)]
+                elif isinstance(condition, (list, tuple, set, frozenset)):
+                    values = condition
+                else:
+                    values = [condition]
+                key_ids = [
+                    document_id
+                    for value in values
+                    for document_id in mapping[key].get(value, [])
+                ]
+                key_ids = np.asarray(key_ids, dtype=np.int64)
+            else:
+                match = _compile_condition(condition)
+                key_ids = self.document_ids_[
+                    [
+                        isinstance(document, dict)
+                        and key in document
+                        and bool(match(document[key]))
+                        for document in self.X_fit_
+                    ]
+                ]
+            ids = np.intersect1d(ids, key_ids)
+        return ids
+
+    def _search_ids(self, X_embedded, filter_ids=None):
+        """Search the identifiers of the most relevant documents of each query.
+
+        Parameters
+        ----------
+        X_embedded : ndarray of shape (n_queries, n_features)
+            The embedded queries.
+
+        filter_ids : ndarray of shape (n_selected,), default=None
+            The sorted identifiers of the documents to search. If None, all the
+            documents are searched.
+
+        Returns
+        -------
+        ids : list of ndarray
+            For each query, the identifiers of the retrieved documents.
+
+        scores : list of ndarray
+            For each query, the inner products between the query and the
+            retrieved documents.
+        """
+        if filter_ids is None:
+            n_selected = len(self.document_ids_)
+        elif len(filter_ids):
+            n_selected = len(filter_ids)
+        else:
+            return (
+                [np.empty(0, dtype=np.int64) for _ in X_embedded],
+                [np.empty(0, dtype=np.float32) for _ in X_embedded],
+            )
+
+        if not isinstance(self.top_k, dict):
+            distances, indices = self._search(X_embedded, self.top_k, ids=filter_ids)
+            found = indices != -1
+            return (
+                [ids[mask] for ids, mask in zip(indices, found)],
+                [scores[mask] for scores, mask in zip(distances, found)],
+            )
+
+        if not all(
+            isinstance(quota, Integral) and quota >= 1 for quota in self.top_k.values()
+        ):
+            raise ValueError(
+                "The number of documents to retrieve from each corpus should be a "
+                f"positive integer, got top_k={self.top_k}."
+            )
+        unknown_corpora = set(self.top_k).difference(self.corpus_to_ids_)
+        if unknown_corpora:
+            raise ValueError(
+                f"The corpora {sorted(unknown_corpora)} are not in the index. The "
+                f"retriever was fitted on the corpora {sorted(self.corpus_to_ids_)}."
+            )
+        # single search over all the corpora, partitioned afterwards by corpus
+        k = min(CORPUS_OVERFETCH_FACTOR * sum(self.top_k.values()), n_selected)
+        k = max(k, 1)
+        distances, indices = self._search(X_embedded, k, ids=filter_ids)
+        results = []
+        for ids, scores in zip(indices, distances):
+            scores, ids = scores[ids != -1], ids[ids != -1]
+            # (identifier, score) of the documents retrieved from each corpus
+            corpus_ids = {corpus: [] for corpus in self.top_k}
+            positions = np.searchsorted(self.document_ids_, ids)
+            for document_id, score, position in zip(ids, scores, positions):
+                corpus = self.X_fit_[position].get("corpus")
+                if (
+                    corpus in corpus_ids
+                    and len(corpus_ids[corpus]) < self.top_k[corpus]
+                ):
+                    corpus_ids[corpus].append((document_id, score))
+            results.append(corpus_ids)
+
+        # search again, restricted to their corpus, the quotas that were not filled
+        for corpus, quota in self.top_k.items():
+            corpus_ids = self.corpus_to_ids_[corpus]
+            if filter_ids is not None:
+                corpus_ids = np.intersect1d(corpus_ids, filter_ids)
+            unfilled = [
+                query_idx
+                for query_idx, query_results in enumerate(results)
+                if len(query_results[corpus]) < min(quota, len(corpus_ids))
+            ]
+            if not unfilled:
+                continue
+            distances, indices = self._search(
+                X_embedded[unfilled], quota, ids=corpus_ids
+            )
+            for query_idx, ids, scores in zip(unfilled, indices, distances):
+                results[query_idx][corpus] = list(
+                    zip(ids[ids != -1], scores[ids != -1])
+                )
+
+        ids = [
+            np.asarray(
+                [
+                    document_id
+                    for corpus in self.top_k
+                    for document_id, _ in query_results[corpus]
+                ],
+                dtype=np.int64,
+            )
+            for query_results in results
+        ]
+        scores = [
+            np.asarray(
+                [score for corpus in self.top_k for _, score in query_results[corpus]],
+                dtype=np.float32,
+            )
+            for query_results in results
+        ]
+        return ids, scores
 
     @_fit_context(prefer_skip_nested_validation=False)
     def fit(self, X, y=None):
@@ -63,13 +649,172 @@ class SemanticRetriever(BaseEstimator):
         """
         self.X_fit_ = X
         start = time.time()
-        self.X_embedded_ = self.embedding.fit_transform(X)
-        self.index_ = faiss.IndexFlatIP(self.X_embedded_.shape[1])
-        self.index_.add(self.X_embedded_)
+        X_embedded = self.embedding.fit_transform(X)
+        if self.projection is not None:
+            self.projection_ = clone(self.projection).fit(X_embedded)
+            X_embedded = self.projection_.transform(X_embedded)
+        else:
+            self.projection_ = None
+        self.index_ = self._build_index(X_embedded)
+        self.document_ids_ = np.empty(0, dtype=np.int64)
+        self.source_to_ids_ = {}
+        self.corpus_to_ids_ = {}
+        self._add(X, X_embedded)
+        self._read_only = False
+        # avoid to keep a full-precision copy of the vectors when they are compressed
+        self.X_embedded_ = X_embedded if self.codec == "flat" else None
         logger.info(f"Index created in {time.time() - start:.2f}s")
         return self
 
-    def query(self, query):
+    @_fit_context(prefer_skip_nested_validation=False)
+    def partial_fit(self, X, y=None):
+        """Embed new sentences and add them to the index.
+
+        Only the new sentences are embedded. The trained structures of the index
+        (e.g. IVF clusters or quantizers) are kept as-is. If the retriever is not
+        fitted yet, this is equivalent to calling :meth:`fit`.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The new input data.
+
+        y : None
+            This parameter is ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not hasattr(self, "X_fit_"):
+            return self.fit(X, y)
+        self._check_writable()
+        if not len(X):
+            return self
+        if len(self.X_fit_) and (
+            isinstance(X[0], dict) != isinstance(self.X_fit_[0], dict)
+        ):
+            raise TypeError(
+                "The new input data should be of the same type as the data used to "
+                f"fit the retriever, got {type(X[0])} instead of "
+                f"{type(self.X_fit_[0])}."
+            )
+        start = time.time()
+        X_embedded = self._embed(X)
+        self._add(X, X_embedded)
+        # create new containers to not modify in-place the data provided by the user
+        self.X_fit_ = list(self.X_fit_) + list(X)
+        if self.X_embedded_ is not None:
+            self.X_embedded_ = np.vstack([self.X_embedded_, X_embedded])
+        logger.info(
+            f"{len(X)} documents added to the index in {time.time() - start:.2f}s"
+        )
+        return self
+
+    def _check_writable(self):
+        """Raise an error if the index cannot be modified."""
+        if getattr(self, "_read_only", False):
+            raise ValueError(
+                "The index is memory-mapped in read-only mode and cannot be updated. "
+                "Load the retriever with `mmap=False` to update it."
+            )
+
+    @_fit_context(prefer_skip_nested_validation=False)
+    def remove_sources(self, sources):
+        """Remove all the documents coming from some sources.
+
+        Only the documents of the given sources are removed from the index: the
+        cost does not depend on the size of the corpus. Removing documents is not
+        supported by the HNSW index and when rescoring is used.
+
+        Parameters
+        ----------
+        sources : str or list of str
+            The sources of the documents to remove. Unknown sources are ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        check_is_fitted(self, "X_fit_")
+        self._check_writable()
+        if isinstance(sources, str):
+            sources = [sources]
+        ids = [
+            document_id
+            for source in sources
+            for document_id in self.source_to_ids_.get(source, [])
+        ]
+        if not ids:
+            return self
+        index = self._get_base_index()
+        if isinstance(index, (faiss.IndexHNSW, faiss.IndexRefine)):
+            raise ValueError(
+                f"Documents cannot be removed from a {type(index).__name__} index. "
+                "Fit the retriever again instead."
+            )
+
+        start = time.time()
+        ids = np.asarray(ids, dtype=np.int64)
+        self.index_.remove_ids(ids)
+        for source in sources:
+            self.source_to_ids_.pop(source, None)
+        removed_corpora = {
+            self.X_fit_[position].get("corpus")
+            for position in np.searchsorted(self.document_ids_, ids)
+        }
+        removed_ids = set(ids.tolist())
+        for corpus in removed_corpora.intersection(self.corpus_to_ids_):
+            self.corpus_to_ids_[corpus] = [
+                document_id
+                for document_id in self.corpus_to_ids_[corpus]
+                if document_id not in removed_ids
+            ]
+        keep = ~np.isin(self.document_ids_, ids)
+        self.X_fit_ = [document for document, k in zip(self.X_fit_, keep) if k]
+        self.document_ids_ = self.document_ids_[keep]
+        if self.X_embedded_ is not None:
+            self.X_embedded_ = self.X_embedded_[keep]
+        logger.info(
+            f"{len(ids)} documents removed from the index in {time.time() - start:.2f}s"
+        )
+        return self
+
+    def upsert(self, X):
+        """Replace the documents of the sources present in `X` by `X`.
+
+        All the documents sharing a source with one of the documents in `X` are
+        removed and the documents in `X` are then added to the index. Only the
+        documents in `X` are embedded.
+
+        Parameters
+        ----------
+        X : list of dict
+            The new documents. They should contain the keys "source" and "text".
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not all(isinstance(document, dict) for document in X):
+            raise TypeError(
+                "upsert requires documents to be dictionaries with a 'source' key."
+            )
+        if hasattr(self, "X_fit_"):
+            self.remove_sources(list({document["source"] for document in X}))
+        return self.partial_fit(X)
+
+    def _get_documents(self, ids, scores, return_result=False):
+        """Map the identifiers returned by the index to the training documents."""
+        positions = np.searchsorted(self.document_ids_, ids)
+        if return_result:
+            return RetrievalResult(ids, scores, self.X_fit_, positions=positions)
+        return [_format_document(self.X_fit_[position]) for position in positions]
+
+    def query(self, query, *, filter=None, return_result=False):
         """Retrieve the most relevant documents for the query.
 
         The inner product is used to compute the cosine similarity meaning that
@@ -80,27 +825,174 @@ class SemanticRetriever(BaseEstimator):
         query : str
             The input data.
 
+        filter : dict, default=None
+            Restrict the search to the documents whose metadata match all the
+            conditions of the dict. The keys are keys of the documents, e.g.
+            "source", "corpus", or "version", and the values are conditions on the
+            value of the documents:
+
+            - a list, tuple, or set of values: the value should be one of them;
+            - a callable: the value should verify the predicate, e.g.
+              `lambda source: "sklearn.ensemble" in source`;
+            - any other value: the value should be equal to it.
+
+            The filter is compiled into a FAISS selector such that the documents
+            are filtered during the search and the `top_k` documents all match the
+            filter. The conditions on "source" and "corpus" are evaluated once
+            per distinct value while the conditions on the other keys are
+            evaluated on each document. If None, all the documents are searched.
+
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` holding the identifiers
+            of the documents, i.e. `document_ids_`, and their cosine similarity
+            with the query.
+
         Returns
         -------
-        list of str or dict
+        list of str or dict or :class:`RetrievalResult`
             The list of the most relevant document from the training set.
         """
         check_is_fitted(self, "X_fit_")
         if not isinstance(query, str):
             raise TypeError(f"query should be a string, got {type(query)}.")
         start = time.time()
-        X_embedded = self.embedding.transform(query)
-        # normalize vectors to compute the cosine similarity
-        _, indices = self.index_.search(X_embedded, self.top_k)
+        filter_ids = None if filter is None else self._filter_ids(filter)
+        X_embedded = self._embed(query)
+        ids, scores = self._search_ids(X_embedded, filter_ids=filter_ids)
         logger.info(f"Semantic search done in {time.time() - start:.2f}s")
-        if isinstance(self.X_fit_[0], dict):
-            return [
-                {
-                    "source": self.X_fit_[neighbor]["source"],
-                    "text": self.X_fit_[neighbor]["text"],
-                }
-                for neighbor in indices[0]
-                if neighbor != -1
-            ]
-        else:  # isinstance(self.X_fit_[0], str)
-            return [self.X_fit_[neighbor] for neighbor in indices[0] if neighbor != -1]
+        return self._get_documents(ids[0], scores[0], return_result)
+
+    def query_batch(self, queries, *, filter=None, return_result=False):
+        """Retrieve the most relevant documents for several queries at once.
+
+        All the queries are embedded with a single call to the embedding and the
+        index is searched a single time with the matrix of embedded queries.
+
+        Parameters
+        ----------
+        queries : list of str
+            The queries.
+
+        filter : dict, default=None
+            Restrict the search of all the queries to the documents whose
+            metadata match all the conditions of the dict. The keys are keys of the
+            documents, e.g. "source", "corpus", or "version", and the values are
+            conditions on the value of the documents:
+
+            - a list, tuple, or set of values: the value should be one of them;
+            - a callable: the value should verify the predicate, e.g.
+              `lambda source: "sklearn.ensemble" in source`;
+            - any other value: the value should be equal to it.
+
+            The filter is compiled into a FAISS selector such that the documents
+            are filtered during the search and the `top_k` documents all match the
+            filter. The conditions on "source" and "corpus" are evaluated once
+            per distinct value while the conditions on the other keys are
+            evaluated on each document. If None, all the documents are searched.
+
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` for each query holding
+            the identifiers of the documents, i.e. `document_ids_`, and their
+            cosine similarity with the query.
+
+        Returns
+        -------
+        list of list of str or dict or list of :class:`RetrievalResult`
+            For each query, the list of the most relevant document from the
+            training set.
+        """
+        check_is_fitted(self, "X_fit_")
+        if isinstance(queries, str) or not all(
+            isinstance(query, str) for query in queries
+        ):
+            raise TypeError(
+                f"queries should be a list of strings, got {type(queries)}."
+            )
+        if not len(queries):
+            return []
+        start = time.time()
+        filter_ids = None if filter is None else self._filter_ids(filter)
+        X_embedded = self._embed(list(queries))
+        ids, scores = self._search_ids(X_embedded, filter_ids=filter_ids)
+        logger.info(
+            f"Semantic search of {len(queries)} queries done in "
+            f"{time.time() - start:.2f}s"
+        )
+        return [
+            self._get_documents(ids_query, scores_query, return_result)
+            for ids_query, scores_query in zip(ids, scores)
+        ]
+
+    def save(self, path):
+        """Save the fitted retriever into a folder.
+
+        The FAISS index is written with the FAISS native writer and the embedded
+        data are stored as a NumPy `.npy` file such that both can be memory-mapped
+        by :meth:`load`. The rest of the retriever, i.e. the parameters, the
+        training documents, and the embedding, is pickled with joblib.
+
+        Parameters
+        ----------
+        path : str or :class:`pathlib.Path`
+            The folder where to save the retriever. It is created if it does not
+            exist.
+        """
+        check_is_fitted(self, "X_fit_")
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(self.index_, str(path / INDEX_FILENAME))
+        if self.X_embedded_ is not None:
+            np.save(path / EMBEDDING_FILENAME, self.X_embedded_)
+        # shallow copy to not pickle the arrays already stored in their own files
+        retriever = copy(self)
+        del retriever.index_
+        retriever.X_embedded_ = None
+        joblib.dump(retriever, path / ESTIMATOR_FILENAME)
+
+    @classmethod
+    def load(cls, path, *, mmap=True):
+        """Load a retriever saved with :meth:`save`.
+
+        Parameters
+        ----------
+        path : str or :class:`pathlib.Path`
+            The folder where the retriever was saved.
+
+        mmap : bool, default=True
+            Whether to memory-map the FAISS index and the embedded data in
+            read-only mode instead of reading them in memory. Loading is then
+            almost instantaneous and several processes loading the same retriever
+            share the same pages of memory. However, the index cannot be modified.
+
+        Returns
+        -------
+        retriever : :class:`SemanticRetriever`
+            The fitted retriever.
+        """
+        path = Path(path)
+        retriever = joblib.load(path / ESTIMATOR_FILENAME)
+        if not isinstance(retriever, cls):
+            raise TypeError(
+                f"The folder {path} does not contain a {cls.__name__}, got "
+                f"{type(retriever).__name__}."
+            )
+        if not mmap:
+            io_flags = 0
+        elif retriever.index_type_ == "ivf":
+            # the inverted lists are memory-mapped; mapping the codes of flat
+            # indices as well makes FAISS fail to read the inverted lists
+            io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        else:
+            # memory-mapping of the codes of the flat indices is only available in
+            # recent versions of FAISS
+            io_flags = getattr(
+                faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+        retriever.index_ = faiss.read_index(str(path / INDEX_FILENAME), io_flags)
+        retriever._read_only = mmap
+        embedding_path = path / EMBEDDING_FILENAME
+        if embedding_path.exists():
+            retriever.X_embedded_ = np.load(
+                embedding_path, mmap_mode="r" if mmap else None
+            )
+        return retriever
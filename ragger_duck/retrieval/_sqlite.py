@@ -0,0 +1,329 @@
+"""Lexical retriever backed by a SQLite FTS5 full-text index."""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from numbers import Integral
+from pathlib import Path
+
+from sklearn.base import BaseEstimator, _fit_context
+from sklearn.utils._param_validation import Interval
+from sklearn.utils.validation import check_is_fitted
+
+from ._result import RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of parameters in a single SQLite query for old SQLite versions
+SQLITE_MAX_VARIABLES = 999
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _match_expression(query):
+    """Build a FTS5 query matching any of the words of a free-text query.
+
+    The words are quoted such that the operators and the punctuation of the
+    query are not interpreted by FTS5.
+    """
+    tokens = dict.fromkeys(token.lower() for token in _TOKEN_PATTERN.findall(query))
+    return " OR ".join('"{}"'.format(token.replace('"', '""')) for token in tokens)
+
+
+class SQLiteBM25Retriever(BaseEstimator):
+    """Retrieve the k-nearest neighbors using the BM25 ranking of SQLite FTS5.
+
+    The documents are stored on disk in a SQLite database with a FTS5 full-text
+    index and ranked with its built-in `bm25()` function. Neither the documents
+    nor the index are held in memory such that the memory does not grow with the
+    size of the corpus. The database can be queried concurrently by several
+    processes, e.g. by pickling the fitted retriever and setting
+    `read_only=True` in the processes serving the queries.
+
+    The connection to the database is opened lazily and is not pickled.
+
+    Parameters
+    ----------
+    path : str or :class:`pathlib.Path`
+        Path to the SQLite database. It is created if it does not exist. Fitting
+        the retriever replaces the documents stored in the database.
+
+    top_k : int, default=1
+        Number of documents to retrieve.
+
+    tokenizer : str, default="unicode61"
+        The FTS5 tokenizer used to index the documents, e.g. `"unicode61"`,
+        `"porter unicode61"` to stem English words, or `"trigram"`.
+
+    read_only : bool, default=False
+        Whether to open the database in read-only mode. The retriever can then be
+        queried but not modified.
+
+    Attributes
+    ----------
+    path_ : :class:`pathlib.Path`
+        The path of the database holding the documents.
+    """
+
+    _parameter_constraints = {
+        "path": [str, Path],
+        "top_k": [Interval(Integral, left=1, right=None, closed="left")],
+        "tokenizer": [str],
+        "read_only": ["boolean"],
+    }
+
+    def __init__(self, path, *, top_k=1, tokenizer="unicode61", read_only=False):
+        self.path = path
+        self.top_k = top_k
+        self.tokenizer = tokenizer
+        self.read_only = read_only
+
+    def __getstate__(self):
+        # `BaseEstimator.__getstate__` returns the `__dict__` of the instance itself
+        state = super().__getstate__().copy()
+        state.pop("_connection", None)
+        state.pop("_lock", None)
+        return state
+
+    def _get_connection(self):
+        """Connection to the database, opened at the first access."""
+        if not hasattr(self, "_lock"):
+            self._lock = threading.Lock()
+        key = (self.path_, self.read_only)
+        connection, connection_key = getattr(self, "_connection", (None, None))
+        if connection is None or connection_key != key:
+            if connection is not None:
+                connection.close()
+            if self.read_only:
+                connection = sqlite3.connect(
+                    f"{self.path_.resolve().as_uri()}?mode=ro",
+                    uri=True,
+                    timeout=60,
+                    check_same_thread=False,
+                )
+            else:
+                self.path_.parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(
+                    str(self.path_), timeout=60, check_same_thread=False
+                )
+                # allow concurrent readers while a process is writing
+                connection.execute("PRAGMA journal_mode=WAL")
+            self._connection = (connection, key)
+        return connection
+
+    def _check_writable(self):
+        """Raise an error if the database cannot be modified."""
+        if self.read_only:
+            raise ValueError(
+                "The database is opened in read-only mode and cannot be updated. "
+                "Set `read_only=False` to update it."
+            )
+
+    @staticmethod
+    def _rows(X):
+        """Rows `(source, text)` of the documents."""
+        return [
+            (x["source"], x["text"]) if isinstance(x, dict) else (None, x) for x in X
+        ]
+
+    @_fit_context(prefer_skip_nested_validation=True)
+    def fit(self, X, y=None):
+        """Store the documents in the database and index them.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The input data.
+
+        y : None
+            This parameter is ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        self._check_writable()
+        start = time.time()
+        self.path_ = Path(self.path)
+        connection = self._get_connection()
+        with self._lock, connection:
+            # the documents are stored in a regular table indexed by source and
+            # the FTS5 index only holds the inverted index of the texts, kept in
+            # sync with triggers
+            connection.executescript(
+                "DROP TABLE IF EXISTS chunks_fts;"
+                "DROP TABLE IF EXISTS chunks;"
+                "CREATE TABLE chunks ("
+                "id INTEGER PRIMARY KEY, source TEXT, text TEXT NOT NULL);"
+                "CREATE INDEX chunks_source ON chunks (source);"
+                "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+                "text, content='chunks', content_rowid='id', "
+                f"tokenize='{self.tokenizer.replace(chr(39), chr(39) * 2)}');"
+                "CREATE TRIGGER chunks_insert AFTER INSERT ON chunks BEGIN "
+                "INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text); END;"
+                "CREATE TRIGGER chunks_delete AFTER DELETE ON chunks BEGIN "
+                "INSERT INTO chunks_fts (chunks_fts, rowid, text) "
+                "VALUES ('delete', old.id, old.text); END;"
+            )
+            connection.executemany(
+                "INSERT INTO chunks (source, text) VALUES (?, ?)", self._rows(X)
+            )
+        logger.info(f"SQLiteBM25Retriever fitted in {time.time() - start:.2f}s")
+        return self
+
+    @_fit_context(prefer_skip_nested_validation=True)
+    def partial_fit(self, X, y=None):
+        """Add new documents to the database.
+
+        Only the new documents are indexed. If the retriever is not fitted yet,
+        this is equivalent to calling :meth:`fit`.
+
+        Parameters
+        ----------
+        X : list of str or dict
+            The new input data.
+
+        y : None
+            This parameter is ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not hasattr(self, "path_"):
+            return self.fit(X, y)
+        self._check_writable()
+        start = time.time()
+        connection = self._get_connection()
+        with self._lock, connection:
+            connection.executemany(
+                "INSERT INTO chunks (source, text) VALUES (?, ?)", self._rows(X)
+            )
+        logger.info(
+            f"{len(X)} documents added to the SQLiteBM25Retriever in "
+            f"{time.time() - start:.2f}s"
+        )
+        return self
+
+    @_fit_context(prefer_skip_nested_validation=True)
+    def remove_sources(self, sources):
+        """Remove all the documents coming from some sources.
+
+        Parameters
+        ----------
+        sources : str or list of str
+            The sources of the documents to remove. Unknown sources are ignored.
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        check_is_fitted(self, "path_")
+        self._check_writable()
+        if isinstance(sources, str):
+            sources = [sources]
+        sources = list(set(sources))
+        start = time.time()
+        connection = self._get_connection()
+        n_removed = 0
+        with self._lock, connection:
+            for batch_start in range(0, len(sources), SQLITE_MAX_VARIABLES):
+                batch = sources[batch_start : batch_start + SQLITE_MAX_VARIABLES]
+                placeholders = ", ".join("?" * len(batch))
+                n_removed += connection.execute(
+                    f"DELETE FROM chunks WHERE source IN ({placeholders})", batch
+                ).rowcount
+        logger.info(
+            f"{n_removed} documents removed from the SQLiteBM25Retriever in "
+            f"{time.time() - start:.2f}s"
+        )
+        return self
+
+    def upsert(self, X):
+        """Replace the documents of the sources present in `X` by `X`.
+
+        All the documents sharing a source with one of the documents in `X` are
+        removed and the documents in `X` are then added to the database.
+
+        Parameters
+        ----------
+        X : list of dict
+            The new documents. They should contain the keys "source" and "text".
+
+        Returns
+        -------
+        self
+            The fitted estimator.
+        """
+        if not all(isinstance(document, dict) for document in X):
+            raise TypeError(
+                "upsert requires documents to be dictionaries with a 'source' key."
+            )
+        if hasattr(self, "path_"):
+            self.remove_sources(list({document["source"] for document in X}))
+        return self.partial_fit(X)
+
+    def query(self, query, *, return_result=False):
+        """Retrieve the most relevant documents for the query.
+
+        The documents containing any of the words of the query are ranked by
+        BM25. If fewer than `top_k` documents match, the first documents of the
+        database complete the results.
+
+        Parameters
+        ----------
+        query : str
+            The input data.
+
+        return_result : bool, default=False
+            Whether to return a :class:`RetrievalResult` holding the row
+            identifiers of the documents in the database and their BM25 scores.
+
+        Returns
+        -------
+        list of str or dict or :class:`RetrievalResult`
+            The list of the most relevant document from the training set.
+        """
+        check_is_fitted(self, "path_")
+        if not isinstance(query, str):
+            raise TypeError(f"query should be a string, got {type(query)}.")
+        start = time.time()
+        match_expression = _match_expression(query)
+        connection = self._get_connection()
+        with self._lock:
+            rows = []
+            if match_expression:
+                rows = connection.execute(
+                    (
+                        "SELECT chunks.id, chunks.source, chunks.text, -rank "
+                        "FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid "
+                        "WHERE chunks_fts MATCH ? ORDER BY rank, chunks.id LIMIT ?"
+                    ),
+                    (match_expression, self.top_k),
+                ).fetchall()
+            if len(rows) < self.top_k:
+                # complete with the first documents, as BM25Retriever does with
+                # the documents without any query term
+                ids = [row[0] for row in rows]
+                placeholders = ", ".join("?" * len(ids))
+                rows += connection.execute(
+                    (
+                        "SELECT id, source, text, 0.0 FROM chunks "
+                        f"WHERE id NOT IN ({placeholders}) ORDER BY id LIMIT ?"
+                    ),
+                    (*ids, self.top_k - len(rows)),
+                ).fetchall()
+        logger.info(f"SQLiteBM25Retriever queried in {time.time() - start:.2f}s")
+        documents = [
+            text if source is None else {"source": source, "text": text}
+            for _, source, text, _ in rows
+        ]
+        if return_result:
+            return RetrievalResult(
+                [row[0] for row in rows], [row[3] for row in rows], documents
+            )
+        return documents
@@ -0,0 +1,35 @@
+"""Private utilities shared by the retrievers."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# thread pools shared by the retrievers, by name and number of threads, to not pay
+# the creation of the threads at each query
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+
+
+def _get_thread_pool(n_threads, name):
+    """Get the shared thread pool `name` with `n_threads` threads.
+
+    Pools with different names are distinct such that a task running in a pool
+    can wait for the tasks it submits to another pool.
+
+    Parameters
+    ----------
+    n_threads : int
+        The number of threads of the pool.
+
+    name : str
+        The name of the pool, also used as prefix of the names of its threads.
+
+    Returns
+    -------
+    thread_pool : :class:`concurrent.futures.ThreadPoolExecutor`
+        The thread pool shared within the process.
+    """
+    with _THREAD_POOLS_LOCK:
+        if (name, n_threads) not in _THREAD_POOLS:
+            _THREAD_POOLS[name, n_threads] = ThreadPoolExecutor(
+                max_workers=n_threads, thread_name_prefix=name
+            )
+        return _THREAD_POOLS[name, n_threads]
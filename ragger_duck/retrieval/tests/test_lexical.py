@@ -1,7 +1,10 @@
+import pickle
+
+import numpy as np
 import pytest
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 
-from ragger_duck.retrieval import BM25Retriever
+from ragger_duck.retrieval import BM25Retriever, PositionalBM25Retriever
 
 
 @pytest.mark.parametrize(
@@ -30,3 +33,441 @@ def test_lexical_retriever_error():
     bm25 = BM25Retriever(top_k=1).fit(input_texts)
     with pytest.raises(TypeError):
         bm25.query(["xxx"])
+
+
+def _bm25_scores(bm25, query):
+    """Reference implementation of the BM25 scores of the documents."""
+    query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+    counts = bm25.X_counts_[:, query_terms_indices].toarray()
+    document_length = bm25.n_terms_by_document_.reshape(-1, 1)
+    denominator = counts + bm25.k1 * (
+        1 - bm25.b + bm25.b * document_length / bm25.averaged_document_length_
+    )
+    idf = bm25.idf_[query_terms_indices]
+    return (idf * counts * (bm25.k1 + 1) / denominator).sum(axis=1)
+
+
+@pytest.mark.parametrize("params", [{}, {"b": 0.5, "k1": 1.2}])
+def test_lexical_retriever_impact(params):
+    """Check that the precomputed impact gives the BM25 scores and that the top
+    documents are ranked by decreasing score."""
+    input_texts = [
+        "xxx yyy",
+        "xxx xxx zzz",
+        "yyy zzz zzz zzz",
+        "aaa",
+        "xxx aaa bbb ccc",
+        "yyy yyy",
+    ]
+    bm25 = BM25Retriever(top_k=4).fit(input_texts).set_params(**params)
+    query = "xxx yyy www"
+
+    scores = _bm25_scores(bm25, query)
+    query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+    np.testing.assert_allclose(bm25._score(query_terms_indices), scores, rtol=1e-6)
+    assert bm25.impact_.format == "csc"
+    assert bm25.impact_.dtype == np.float32
+
+    expected = [input_texts[idx] for idx in np.argsort(-scores, kind="stable")[:4]]
+    assert bm25.query(query) == expected
+    assert len(bm25.set_params(top_k=10).query(query)) == len(input_texts)
+
+
+@pytest.mark.parametrize("impact_dtype", ["float32", "uint8"])
+@pytest.mark.parametrize("dense_fraction", [np.inf, 0.0])
+def test_lexical_retriever_maxscore(monkeypatch, impact_dtype, dense_fraction):
+    """Check that MaxScore retrieves the same documents as the exhaustive search
+    while only scoring a subset of the documents."""
+    # accumulate the partial scores in sparse arrays or in a dense array
+    monkeypatch.setattr(
+        "ragger_duck.retrieval._lexical.MAXSCORE_DENSE_FRACTION",
+        dense_fraction,
+        raising=True,
+    )
+    rng = np.random.RandomState(0)
+    vocabulary = [f"word{idx}" for idx in range(50)]
+    input_texts = [
+        " ".join(rng.choice(vocabulary, size=rng.randint(5, 30))) for _ in range(500)
+    ]
+    queries = [" ".join(rng.choice(vocabulary, size=6)) for _ in range(10)]
+    params = {
+        "count_vectorizer": CountVectorizer(ngram_range=(1, 2)),
+        "top_k": 5,
+        "impact_dtype": impact_dtype,
+    }
+    bm25 = BM25Retriever(**params).fit(input_texts)
+    bm25_maxscore = BM25Retriever(algorithm="maxscore", **params).fit(input_texts)
+    assert bm25_maxscore.impact_.dtype == impact_dtype
+
+    for query in queries:
+        query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+        scores = bm25._score(query_terms_indices)
+        documents, scores_maxscore = bm25_maxscore._score_maxscore(
+            query_terms_indices, top_k=5
+        )
+        if dense_fraction == np.inf:
+            assert len(documents) < np.count_nonzero(scores)
+        np.testing.assert_allclose(scores_maxscore, scores[documents], rtol=1e-6)
+        np.testing.assert_allclose(
+            np.sort(scores_maxscore)[-5:], np.sort(scores)[-5:], rtol=1e-6
+        )
+        assert bm25_maxscore.query(query) == bm25.query(query)
+
+
+def test_lexical_retriever_maxscore_few_matches():
+    """Check that MaxScore completes the top documents with documents without any
+    query term, as the exhaustive search."""
+    input_texts = ["xxx yyy", "aaa", "bbb", "xxx", "ccc"]
+    bm25 = BM25Retriever(top_k=4).fit(input_texts)
+    bm25_maxscore = BM25Retriever(top_k=4, algorithm="maxscore").fit(input_texts)
+    assert bm25_maxscore.query("xxx") == bm25.query("xxx")
+    assert bm25_maxscore.query("zzz") == bm25.query("zzz")
+
+
+def test_lexical_retriever_impact_quantized():
+    """Check that the quantized impact approximates the BM25 scores."""
+    input_texts = ["xxx yyy", "xxx xxx zzz", "yyy zzz zzz zzz", "aaa", "yyy yyy"]
+    bm25 = BM25Retriever(top_k=5, impact_dtype="uint8").fit(input_texts)
+    assert bm25.impact_.dtype == np.uint8
+    assert bm25.impact_.max() == 255
+
+    query = "xxx yyy"
+    query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+    scores = _bm25_scores(bm25, query)
+    np.testing.assert_allclose(
+        bm25._score(query_terms_indices), scores, atol=2 * bm25.impact_scale_
+    )
+
+
+@pytest.mark.parametrize("impact_dtype", ["float32", "uint8"])
+def test_lexical_retriever_pickle(impact_dtype):
+    """Check that the impact is not pickled and is computed again at the first
+    query of the unpickled retriever."""
+    documents = _make_documents(40, random_state=0)
+    bm25 = BM25Retriever(top_k=5, impact_dtype=impact_dtype).fit(documents)
+    queries = ["word1 word2 word3", "word4 word5"]
+    expected = [bm25.query(query) for query in queries]
+
+    bm25_unpickled = pickle.loads(pickle.dumps(bm25))
+    assert not hasattr(bm25_unpickled, "impact_")
+    assert not hasattr(bm25_unpickled, "max_impact_")
+    # pickling does not alter the retriever
+    assert hasattr(bm25, "impact_")
+
+    for query, documents_query in zip(queries, expected):
+        assert bm25_unpickled.query(query) == documents_query
+    np.testing.assert_array_equal(bm25_unpickled.impact_.data, bm25.impact_.data)
+    assert bm25_unpickled.impact_scale_ == bm25.impact_scale_
+
+
+def test_lexical_retriever_hashing_vectorizer():
+    """Check that a HashingVectorizer can replace the CountVectorizer without
+    storing a vocabulary."""
+    input_texts = [
+        "xxx yyy",
+        "xxx xxx zzz",
+        "yyy zzz zzz zzz",
+        "aaa",
+        "xxx aaa bbb ccc",
+        "yyy yyy",
+    ]
+    bm25 = BM25Retriever(
+        count_vectorizer=CountVectorizer(ngram_range=(1, 2)), top_k=4
+    ).fit(input_texts)
+    bm25_hashing = BM25Retriever(
+        count_vectorizer=HashingVectorizer(
+            ngram_range=(1, 2), n_features=2**18, alternate_sign=False, norm=None
+        ),
+        top_k=4,
+    ).fit(input_texts)
+    assert not hasattr(bm25_hashing.count_vectorizer_, "vocabulary_")
+    assert bm25_hashing.impact_.shape == (len(input_texts), 2**18)
+
+    for query in ["xxx yyy www", "zzz", "xxx aaa"]:
+        assert bm25_hashing.query(query) == bm25.query(query)
+
+    # the idf of the terms occurring more often than the number of documents is
+    # floored from the idf of the terms found in the documents only, not from the
+    # empty columns of the HashingVectorizer
+    input_texts = [f"the the {text}" for text in input_texts]
+    bm25.fit(input_texts)
+    bm25_hashing.fit(input_texts)
+    the_idx = bm25.count_vectorizer_.vocabulary_["the"]
+    the_idx_hashing = bm25_hashing.count_vectorizer_.transform(["the"]).indices[0]
+    assert bm25.idf_[the_idx] > 0
+    np.testing.assert_allclose(bm25_hashing.idf_[the_idx_hashing], bm25.idf_[the_idx])
+    for query in ["the xxx", "the zzz zzz", "the"]:
+        result = bm25.query(query, return_result=True)
+        result_hashing = bm25_hashing.query(query, return_result=True)
+        np.testing.assert_array_equal(result_hashing.ids, result.ids)
+        np.testing.assert_allclose(result_hashing.scores, result.scores, rtol=1e-5)
+
+
+@pytest.mark.parametrize("params", [{}, {"alternate_sign": False}, {"norm": None}])
+def test_lexical_retriever_hashing_vectorizer_error(params):
+    """Check that we raise an error when the HashingVectorizer does not count the
+    terms."""
+    bm25 = BM25Retriever(count_vectorizer=HashingVectorizer(**params))
+    with pytest.raises(ValueError, match="alternate_sign=False and norm=None"):
+        bm25.fit(["xxx", "yyy"])
+
+
+@pytest.mark.parametrize("ngram_range", [(1, 1), (1, 3), (2, 3)])
+def test_positional_retriever(ngram_range):
+    """Check that matching the phrases at query time gives the scores of the
+    n-grams indexed by the BM25Retriever with a smaller index."""
+    rng = np.random.RandomState(0)
+    vocabulary = [f"word{idx}" for idx in range(20)]
+    input_texts = [
+        " ".join(rng.choice(vocabulary, size=rng.randint(1, 30))) for _ in range(200)
+    ]
+    queries = [" ".join(rng.choice(vocabulary, size=6)) for _ in range(10)]
+    queries += [input_texts[0], "word0 unknown word1"]
+    # short queries whose n-grams are found in fewer than `top_k` documents
+    queries += [
+        " ".join(rng.choice(vocabulary, size=rng.randint(2, 4))) for _ in range(30)
+    ]
+    count_vectorizer = CountVectorizer(ngram_range=ngram_range)
+    bm25 = BM25Retriever(count_vectorizer=count_vectorizer, top_k=5).fit(input_texts)
+    positional = PositionalBM25Retriever(
+        count_vectorizer=count_vectorizer, top_k=5
+    ).fit(input_texts)
+    assert positional.ngram_range_ == ngram_range
+    assert positional.count_vectorizer_.ngram_range == (1, 1)
+    if ngram_range != (1, 1):
+        assert len(positional.postings_) < bm25.X_counts_.nnz
+
+    for query in queries:
+        query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+        np.testing.assert_allclose(
+            positional._score(query), bm25._score(query_terms_indices), rtol=1e-5
+        )
+        # the ties, e.g. the documents without any query term, are broken by
+        # position as in BM25Retriever
+        assert positional.query(query) == bm25.query(query)
+
+
+def test_positional_retriever_frequent_terms():
+    """Check that the terms occurring more often than the number of documents get
+    the same inverse document frequency as with the BM25Retriever."""
+    input_texts = ["xxx xxx xxx yyy", "xxx xxx zzz", "yyy yyy zzz zzz", "aaa"]
+    bm25 = BM25Retriever(top_k=4).fit(input_texts)
+    positional = PositionalBM25Retriever(top_k=4).fit(input_texts)
+    np.testing.assert_allclose(positional.idf_, bm25.idf_)
+    assert bm25.idf_[bm25.count_vectorizer_.vocabulary_["xxx"]] > 0
+    for query in ["xxx", "xxx yyy zzz"]:
+        query_terms_indices = bm25.count_vectorizer_.transform([query]).indices
+        np.testing.assert_allclose(
+            positional._score(query), bm25._score(query_terms_indices), rtol=1e-6
+        )
+
+
+def test_positional_retriever_phrase_boundaries():
+    """Check that a phrase is not matched across two documents or across a token
+    out of the vocabulary."""
+    input_texts = [
+        {"source": "source 1", "text": "aaa bbb"},
+        {"source": "source 2", "text": "ccc ddd"},
+        {"source": "source 3", "text": "bbb rare ccc bbb ccc"},
+    ]
+    positional = PositionalBM25Retriever(
+        count_vectorizer=CountVectorizer(ngram_range=(2, 2), min_df=2), top_k=1
+    ).fit(input_texts)
+    assert "rare" not in positional.count_vectorizer_.vocabulary_
+    np.testing.assert_array_equal(positional._score("bbb ccc") > 0, [0, 0, 1])
+    np.testing.assert_array_equal(positional._score("rare ccc") > 0, [0, 0, 0])
+    assert positional.query("bbb ccc") == [
+        {"source": "source 3", "text": "bbb rare ccc bbb ccc"}
+    ]
+
+
+def test_positional_retriever_error():
+    """Check the errors raised by the PositionalBM25Retriever."""
+    with pytest.raises(ValueError, match="word analyzer"):
+        PositionalBM25Retriever(count_vectorizer=CountVectorizer(analyzer="char")).fit(
+            ["xxx"]
+        )
+    positional = PositionalBM25Retriever().fit(["xxx"])
+    with pytest.raises(TypeError):
+        positional.query(["xxx"])
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+@pytest.mark.parametrize("impact_dtype", ["float32", "uint8"])
+def test_lexical_retriever_query_batch(monkeypatch, n_jobs, impact_dtype):
+    """Check that querying several queries at once gives the results of the
+    individual queries."""
+    monkeypatch.setattr(
+        "ragger_duck.retrieval._lexical.QUERY_CHUNK_SIZE", 3, raising=True
+    )
+    rng = np.random.RandomState(0)
+    vocabulary = [f"word{idx}" for idx in range(50)]
+    input_texts = [
+        {"source": f"source {idx}", "text": " ".join(rng.choice(vocabulary, size=10))}
+        for idx in range(100)
+    ]
+    queries = [" ".join(rng.choice(vocabulary, size=4)) for _ in range(10)]
+    queries += ["unknown", "word0 word0"]
+    bm25 = BM25Retriever(top_k=5, impact_dtype=impact_dtype, n_jobs=n_jobs)
+    bm25.fit(input_texts)
+    assert bm25.query_batch(queries) == [bm25.query(query) for query in queries]
+    assert bm25.query_batch([]) == []
+    with pytest.raises(TypeError):
+        bm25.query_batch("xxx")
+
+
+def _make_documents(n_documents, random_state):
+    rng = np.random.RandomState(random_state)
+    vocabulary = [f"word{idx}" for idx in range(30)]
+    return [
+        {
+            "source": f"source {idx // 2}",
+            "text": " ".join(rng.choice(vocabulary, size=rng.randint(1, 15))),
+        }
+        for idx in range(n_documents)
+    ]
+
+
+@pytest.mark.parametrize(
+    "count_vectorizer",
+    [
+        CountVectorizer(ngram_range=(1, 2)),
+        HashingVectorizer(n_features=2**18, alternate_sign=False, norm=None),
+    ],
+)
+def test_lexical_retriever_partial_fit(count_vectorizer):
+    """Check that adding documents with partial_fit gives the same retriever as
+    fitting on all the documents, including terms unseen in the first call."""
+    documents = _make_documents(60, random_state=0)
+    new_documents = [{"source": "new", "text": "brandnew word1"}]
+    new_documents += _make_documents(10, random_state=1)
+    params = {"count_vectorizer": count_vectorizer, "top_k": 5}
+    bm25 = BM25Retriever(**params).fit(documents + new_documents)
+    bm25_partial = BM25Retriever(**params).partial_fit(documents)
+    bm25_partial.partial_fit(new_documents[:5]).partial_fit(new_documents[5:])
+    bm25_partial.partial_fit([])
+    assert bm25_partial.X_fit_ == documents + new_documents
+
+    for query in ["brandnew", "word1 word2 word3", "word4 word5"]:
+        assert bm25_partial.query(query) == bm25.query(query)
+    np.testing.assert_allclose(
+        bm25_partial.averaged_document_length_, bm25.averaged_document_length_
+    )
+
+    with pytest.raises(TypeError, match="same type"):
+        bm25_partial.partial_fit(["xxx"])
+
+
+def test_lexical_retriever_remove_sources():
+    """Check that removing and upserting sources gives the same retriever as
+    fitting on the remaining documents."""
+    documents = _make_documents(60, random_state=0)
+    # a term more frequent than the number of documents, whose idf is floored,
+    # and terms only found in the removed sources
+    for idx, document in enumerate(documents):
+        document["text"] = f"the the {document['text']}"
+        if document["source"] in ("source 0", "source 3"):
+            document["text"] += f" gone{idx}"
+    bm25 = BM25Retriever(top_k=5).fit(documents)
+    bm25.query("word1")
+    bm25.remove_sources(["source 0", "source 3", "unknown"]).remove_sources([])
+    remaining = [
+        document
+        for document in documents
+        if document["source"] not in ("source 0", "source 3")
+    ]
+    assert bm25.X_fit_ == remaining
+    bm25_remaining = BM25Retriever(top_k=5).fit(remaining)
+    for query in ["word1 word2 word3", "word4 word5", "the word6"]:
+        assert bm25.query(query) == bm25_remaining.query(query)
+        assert bm25.query_batch([query]) == [bm25_remaining.query(query)]
+        np.testing.assert_allclose(
+            bm25.query(query, return_result=True).scores,
+            bm25_remaining.query(query, return_result=True).scores,
+            rtol=1e-5,
+        )
+
+    updated = [{"source": "source 1", "text": "word1 word1 word2"}]
+    bm25.upsert(updated)
+    assert bm25.X_fit_ == [d for d in remaining if d["source"] != "source 1"] + updated
+    assert bm25.query("word1 word2")[0] == updated[0]
+    with pytest.raises(TypeError, match="dictionaries"):
+        bm25.upsert(["xxx"])
+
+
+@pytest.mark.parametrize("top_k", [1, 5, 12])
+@pytest.mark.parametrize("impact_dtype", ["float32", "uint8"])
+def test_lexical_retriever_sharded(monkeypatch, top_k, impact_dtype):
+    """Check that scoring shards of documents in parallel threads gives exactly
+    the documents of the unsharded scoring."""
+    monkeypatch.setattr(
+        "ragger_duck.retrieval._lexical.SHARD_MIN_DOCUMENTS", 10, raising=True
+    )
+    documents = _make_documents(45, random_state=0)
+    queries = ["word1 word2 word3", "word4", "word0 word1 word2 word3 word4", "xxx"]
+    params = {"top_k": top_k, "impact_dtype": impact_dtype}
+    bm25 = BM25Retriever(**params).fit(documents)
+    bm25_sharded = BM25Retriever(n_jobs=3, **params).fit(documents)
+
+    n_sharded_queries = 0
+    top_k_sharded = bm25_sharded._top_k_sharded
+
+    def spy(query_terms_indices, n_shards):
+        nonlocal n_sharded_queries
+        n_sharded_queries += 1
+        assert n_shards == 3
+        return top_k_sharded(query_terms_indices, n_shards)
+
+    monkeypatch.setattr(bm25_sharded, "_top_k_sharded", spy)
+    for query in queries:
+        assert bm25_sharded.query(query) == bm25.query(query)
+    assert n_sharded_queries == len(queries)
+
+
+@pytest.mark.parametrize("algorithm", ["exhaustive", "maxscore"])
+def test_lexical_retriever_return_result(algorithm):
+    """Check that the result holds the retrieved documents with stable ids and
+    their BM25 scores."""
+    input_texts = [
+        {"source": "source 1", "text": "xxx yyy"},
+        {"source": "source 2", "text": "xxx xxx"},
+        {"source": "source 3", "text": "zzz"},
+        {"source": "source 2", "text": "yyy"},
+    ]
+    retriever = BM25Retriever(top_k=2, algorithm=algorithm).fit(input_texts)
+    np.testing.assert_array_equal(retriever.document_ids_, np.arange(4))
+
+    result = retriever.query("xxx", return_result=True)
+    assert list(result) == retriever.query("xxx")
+    np.testing.assert_array_equal(result.ids, [1, 0])
+    assert np.all(np.diff(result.scores) <= 0)
+    assert np.all(result.scores > 0)
+    reference = BM25Retriever(top_k=2, algorithm="exhaustive").fit(input_texts)
+    np.testing.assert_allclose(
+        result.scores, reference.query("xxx", return_result=True).scores, rtol=1e-3
+    )
+    assert result.sources == ["source 2", "source 1"]
+
+    batch = retriever.query_batch(["xxx", "zzz"], return_result=True)
+    assert [list(result) for result in batch] == retriever.query_batch(["xxx", "zzz"])
+    np.testing.assert_array_equal(batch[0].ids, result.ids)
+
+    # the ids of the remaining documents are not shifted by the removal
+    retriever.remove_sources(["source 2"])
+    retriever.partial_fit([{"source": "source 4", "text": "xxx"}])
+    np.testing.assert_array_equal(retriever.document_ids_, [0, 2, 4])
+    result = retriever.query("zzz", return_result=True)
+    assert result.ids[0] == 2
+    assert result[0] == {"source": "source 3", "text": "zzz"}
+
+
+def test_positional_retriever_return_result():
+    """Check that the positional retriever returns the scores of the documents."""
+    input_texts = ["new york city", "york new city", "city"]
+    retriever = PositionalBM25Retriever(
+        count_vectorizer=CountVectorizer(ngram_range=(1, 2)), top_k=2
+    ).fit(input_texts)
+    result = retriever.query("new york", return_result=True)
+    assert list(result) == retriever.query("new york")
+    assert result.ids[0] == 0
+    assert np.all(np.diff(result.scores) <= 0)
@@ -1,3 +1,4 @@
+import threading
 from pathlib import Path
 
 import pytest
@@ -12,6 +13,26 @@ class DummyRetriever:
         return []
 
 
+class BarrierRetriever:
+    """Retriever waiting for the other retrievers to be queried concurrently."""
+
+    def __init__(self, barrier, documents):
+        self.barrier = barrier
+        self.documents = documents
+
+    def query(self, query):
+        self.barrier.wait()
+        return self.documents
+
+
+class ListRetriever:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def query(self, query):
+        return self.documents
+
+
 @pytest.mark.parametrize(
     "params, n_documents",
     [
@@ -143,3 +164,61 @@ def test_retriever_reranker_tags():
         retrievers=[bm25, faiss], cross_encoder=cross_encoder
     )
     assert retriever_reranker._get_tags()["stateless"]
+
+
+def test_retriever_reranker_mixed_retrievers():
+    """Check that retrievers returning a result and a list can be combined."""
+    input_texts = [
+        {"source": "source 1", "text": "xxx"},
+        {"source": "source 2", "text": "yyy"},
+    ]
+    bm25 = BM25Retriever(top_k=2).fit(input_texts)
+    cross_encoder = CrossEncoder(model_name="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    retriever_reranker = RetrieverReranker(
+        retrievers=[bm25, ListRetriever([input_texts[1]])],
+        cross_encoder=cross_encoder,
+    ).fit()
+    documents = retriever_reranker.query("xxx")
+    assert len(documents) == 2
+    assert sorted(documents, key=lambda document: document["source"]) == input_texts
+
+
+@pytest.mark.parametrize("n_jobs", [2, -1])
+def test_retriever_reranker_n_jobs(n_jobs):
+    """Check that querying the retrievers in threads gives the same documents."""
+    input_texts = [
+        {"source": "source 1", "text": "xxx"},
+        {"source": "source 2", "text": "yyy"},
+        {"source": "source 3", "text": "xxx yyy"},
+    ]
+    retrievers = [
+        BM25Retriever(top_k=2).fit(input_texts),
+        ListRetriever(input_texts[::-1]),
+        BM25Retriever(top_k=1).fit(input_texts),
+    ]
+    cross_encoder = CrossEncoder(model_name="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    params = {"retrievers": retrievers, "cross_encoder": cross_encoder}
+    for drop_duplicates in (True, False):
+        expected = RetrieverReranker(**params, drop_duplicates=drop_duplicates).query(
+            "xxx"
+        )
+        retriever_reranker = RetrieverReranker(
+            **params, drop_duplicates=drop_duplicates, n_jobs=n_jobs
+        )
+        for _ in range(3):
+            assert retriever_reranker.query("xxx") == expected
+
+
+def test_retriever_reranker_n_jobs_concurrent():
+    """Check that the retrievers are queried concurrently."""
+    barrier = threading.Barrier(2, timeout=10)
+    cross_encoder = CrossEncoder(model_name="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    retriever_reranker = RetrieverReranker(
+        retrievers=[
+            BarrierRetriever(barrier, ["xxx"]),
+            BarrierRetriever(barrier, ["yyy"]),
+        ],
+        cross_encoder=cross_encoder,
+        n_jobs=2,
+    )
+    assert sorted(retriever_reranker.query("xxx")) == ["xxx", "yyy"]
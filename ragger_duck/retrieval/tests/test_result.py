@@ -0,0 +1,39 @@
+import numpy as np
+
+from ragger_duck.retrieval import RetrievalResult
+
+
+def test_retrieval_result():
+    """Check that a result behaves as the list of the retrieved documents."""
+    documents = [
+        {"source": "source 1", "text": "xxx", "corpus": "api"},
+        {"source": "source 2", "text": "yyy"},
+        {"source": "source 3", "text": "zzz", "corpus": "gallery"},
+    ]
+    result = RetrievalResult([7, 5], [2.0, 1.0], documents, positions=[2, 0])
+
+    assert len(result) == 2
+    assert list(result) == [
+        {"source": "source 3", "text": "zzz"},
+        {"source": "source 1", "text": "xxx"},
+    ]
+    assert result[-1] == {"source": "source 1", "text": "xxx"}
+    np.testing.assert_array_equal(result.ids, [7, 5])
+    np.testing.assert_allclose(result.scores, [2.0, 1.0])
+    assert result.texts == ["zzz", "xxx"]
+    assert result.sources == ["source 3", "source 1"]
+    np.testing.assert_array_equal(result.corpus, ["gallery", "api"])
+
+    head = result[:1]
+    assert isinstance(head, RetrievalResult)
+    np.testing.assert_array_equal(head.ids, [7])
+    assert list(head) == [{"source": "source 3", "text": "zzz"}]
+
+
+def test_retrieval_result_str_documents():
+    """Check the fields of a result holding documents given as strings."""
+    result = RetrievalResult([1, 0], [0.5, 0.1], ["xxx", "yyy"])
+    assert list(result) == ["xxx", "yyy"]
+    assert result.texts == ["xxx", "yyy"]
+    assert result.sources == [None, None]
+    assert list(result.corpus) == [None, None]
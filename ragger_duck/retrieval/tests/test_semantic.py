@@ -1,8 +1,9 @@
 from pathlib import Path
 
+import numpy as np
 import pytest
 
-from ragger_duck.embedding import SentenceTransformer
+from ragger_duck.embedding import EmbeddingProjection, SentenceTransformer
 from ragger_duck.retrieval import SemanticRetriever
 
 
@@ -80,3 +81,672 @@ def test_semantic_retriever_max_documents_at_fit(input_texts):
 
     faiss = SemanticRetriever(embedding=embedder, top_k=20).fit(input_texts)
     assert len(faiss.query("xx")) == len(input_texts)
+
+
+@pytest.mark.parametrize(
+    "input_texts",
+    [
+        [
+            {"source": "source 1", "text": "xxx"},
+            {"source": "source 2", "text": "yyy"},
+        ],
+        ["xxx", "yyy"],
+    ],
+)
+def test_semantic_retriever_query_batch(input_texts):
+    """Check that querying by batch is equivalent to querying one by one."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    faiss = SemanticRetriever(embedding=embedder, top_k=2).fit(input_texts)
+    queries = ["xx", "yy", "xxx"]
+    assert faiss.query_batch(queries) == [faiss.query(query) for query in queries]
+    assert faiss.query_batch([]) == []
+
+    with pytest.raises(TypeError):
+        faiss.query_batch("xx")
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_semantic_retriever_index_type(index_type):
+    """Check that the approximate indices retrieve the same documents as the exact
+    index on a small corpus."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = ["xxx", "yyy", "zzz", "aaa", "bbb", "ccc"]
+    params = {"top_k": 1, "n_lists": 2, "n_probe": 2, "random_state": 0}
+    exact = SemanticRetriever(embedding=embedder, index_type="flat", **params)
+    approximate = SemanticRetriever(embedding=embedder, index_type=index_type, **params)
+    exact.fit(input_texts)
+    approximate.fit(input_texts)
+
+    assert approximate.index_type_ == index_type
+    assert approximate.index_.ntotal == len(input_texts)
+    assert approximate.query("xx") == exact.query("xx")
+
+
+def test_semantic_retriever_index_type_auto():
+    """Check that a small corpus leads to an exact search."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    faiss = SemanticRetriever(embedding=embedder).fit(["xxx", "yyy"])
+    assert faiss.index_type_ == "flat"
+
+
+@pytest.mark.parametrize(
+    "index_type, search_param", [("ivf", "n_probe"), ("hnsw", "ef_search")]
+)
+def test_semantic_retriever_search_params_without_refit(index_type, search_param):
+    """Check that the query-time parameters can be changed without refitting."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = ["xxx", "yyy", "zzz", "aaa", "bbb", "ccc"]
+    faiss = SemanticRetriever(
+        embedding=embedder, top_k=6, index_type=index_type, n_lists=3, random_state=0
+    ).fit(input_texts)
+    index = faiss.index_
+
+    faiss.set_params(**{search_param: 1})
+    faiss.query("xx")
+    faiss.set_params(**{search_param: 16})
+    assert len(faiss.query("xx")) == len(input_texts)
+    assert faiss.index_ is index
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("codec", ["fp16", "bf16", "sq8", "pq"])
+@pytest.mark.parametrize("rescore_factor", [None, 2])
+def test_semantic_retriever_codec(index_type, codec, rescore_factor):
+    """Check that compressed indices retrieve the documents and do not store the
+    full-precision embedding."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = ["xxx", "yyy", "zzz", "aaa", "bbb", "ccc"]
+    faiss = SemanticRetriever(
+        embedding=embedder,
+        top_k=len(input_texts),
+        index_type=index_type,
+        n_lists=2,
+        n_probe=2,
+        codec=codec,
+        pq_m=8,
+        rescore_factor=rescore_factor,
+        random_state=0,
+    ).fit(input_texts)
+
+    assert faiss.X_embedded_ is None
+    assert sorted(faiss.query("xx")) == sorted(input_texts)
+    if rescore_factor is not None:
+        assert faiss.set_params(top_k=1).query("xx") == ["xxx"]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_semantic_retriever_float16_embedding(index_type):
+    """Check that the retriever accepts an embedding in half precision and stores
+    it as is."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+        dtype="float16",
+    )
+
+    input_texts = ["xxx", "yyy", "zzz", "aaa", "bbb", "ccc"]
+    faiss = SemanticRetriever(
+        embedding=embedder,
+        top_k=1,
+        index_type=index_type,
+        n_lists=2,
+        n_probe=2,
+        random_state=0,
+    ).fit(input_texts[:3])
+    faiss.partial_fit(input_texts[3:])
+
+    assert faiss.X_embedded_.dtype == np.float16
+    assert faiss.X_embedded_.shape[0] == len(input_texts)
+    assert faiss.query("xx") == ["xxx"]
+    assert faiss.query("bb") == ["bbb"]
+
+
+def test_semantic_retriever_projection():
+    """Check that the projection is fitted on the documents and applied to the
+    documents and the queries."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = ["xxx", "yyy", "zzz", "aaa", "bbb"]
+    # the projection is lossless since the embedded documents span a subspace
+    # of dimension `len(input_texts)`
+    projection = EmbeddingProjection(n_components=8, random_state=0)
+    faiss = SemanticRetriever(embedding=embedder, top_k=1, projection=projection)
+    faiss.fit(input_texts)
+
+    assert not hasattr(projection, "components_")
+    assert faiss.projection_.n_components_ == len(input_texts)
+    assert faiss.X_embedded_.shape == (len(input_texts), len(input_texts))
+    assert faiss.index_.d == len(input_texts)
+    for text in input_texts:
+        assert faiss.query(text) == [text]
+
+    faiss.partial_fit(["ccc"])
+    assert faiss.X_embedded_.shape == (len(input_texts) + 1, len(input_texts))
+
+
+def test_semantic_retriever_codec_pq_m_error():
+    """Check that we raise an error when `pq_m` does not divide the embedding
+    size."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    faiss = SemanticRetriever(embedding=embedder, codec="pq", pq_m=7)
+    with pytest.raises(ValueError, match="should divide the number of features"):
+        faiss.fit(["xxx", "yyy"])
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("codec", ["flat", "sq8", "pq"])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_semantic_retriever_save_load(tmp_path, index_type, codec, mmap):
+    """Check that a saved retriever can be loaded and gives the same results."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [
+        {"source": "source 1", "text": "xxx"},
+        {"source": "source 2", "text": "yyy"},
+    ]
+    faiss = SemanticRetriever(
+        embedding=embedder,
+        top_k=2,
+        index_type=index_type,
+        n_lists=2,
+        n_probe=2,
+        codec=codec,
+        pq_m=8,
+        random_state=0,
+    )
+    faiss.fit(input_texts)
+    faiss.save(tmp_path / "retriever")
+
+    faiss_loaded = SemanticRetriever.load(tmp_path / "retriever", mmap=mmap)
+    assert faiss_loaded.get_params()["codec"] == codec
+    assert faiss_loaded.index_type_ == index_type
+    assert faiss_loaded.X_fit_ == input_texts
+    assert faiss_loaded.index_.ntotal == len(input_texts)
+    assert faiss_loaded.query("xx") == faiss.query("xx")
+    if codec == "flat":
+        assert isinstance(faiss_loaded.X_embedded_, np.memmap) == mmap
+        np.testing.assert_allclose(faiss_loaded.X_embedded_, faiss.X_embedded_)
+    else:
+        assert faiss_loaded.X_embedded_ is None
+    # saving should not alter the retriever
+    assert faiss.X_embedded_ is not None or codec != "flat"
+    assert faiss.index_.ntotal == len(input_texts)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize(
+    "input_texts",
+    [
+        [
+            {"source": "source 1", "text": "xxx"},
+            {"source": "source 2", "text": "yyy"},
+            {"source": "source 3", "text": "zzz"},
+            {"source": "source 4", "text": "aaa"},
+        ],
+        ["xxx", "yyy", "zzz", "aaa"],
+    ],
+)
+def test_semantic_retriever_partial_fit(input_texts, index_type):
+    """Check that adding documents with `partial_fit` is equivalent to fitting on
+    all the documents."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    params = {"top_k": 1, "index_type": index_type, "n_lists": 1, "random_state": 0}
+    faiss = SemanticRetriever(embedding=embedder, **params).fit(input_texts)
+    faiss_incremental = SemanticRetriever(embedding=embedder, **params)
+    faiss_incremental.partial_fit(input_texts[:2]).partial_fit(input_texts[2:])
+
+    assert faiss_incremental.X_fit_ == input_texts
+    assert faiss_incremental.index_.ntotal == len(input_texts)
+    np.testing.assert_allclose(faiss_incremental.X_embedded_, faiss.X_embedded_)
+    for query in ("xx", "zz", "aa"):
+        assert faiss_incremental.query(query) == faiss.query(query)
+
+    with pytest.raises(TypeError, match="should be of the same type"):
+        faiss_incremental.partial_fit(
+            ["bbb"] if isinstance(input_texts[0], dict) else [{"text": "bbb"}]
+        )
+
+
+def test_semantic_retriever_partial_fit_read_only(tmp_path):
+    """Check that we raise an error when updating a memory-mapped index."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    SemanticRetriever(embedding=embedder).fit(["xxx", "yyy"]).save(tmp_path)
+    with pytest.raises(ValueError, match="read-only"):
+        SemanticRetriever.load(tmp_path).partial_fit(["zzz"])
+    faiss = SemanticRetriever.load(tmp_path, mmap=False).partial_fit(["zzz"])
+    assert faiss.index_.ntotal == 3
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"index_type": "flat"},
+        {"index_type": "ivf", "n_lists": 1},
+        {"index_type": "flat", "codec": "sq8"},
+    ],
+)
+def test_semantic_retriever_remove_sources_and_upsert(params):
+    """Check that we can remove and replace the documents of a source."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [
+        {"source": "source 1", "text": "xxx"},
+        {"source": "source 2", "text": "yyy"},
+        {"source": "source 1", "text": "zzz"},
+        {"source": "source 3", "text": "aaa"},
+    ]
+    faiss = SemanticRetriever(embedding=embedder, top_k=10, **params)
+    faiss.fit(input_texts)
+    assert faiss.source_to_ids_ == {
+        "source 1": [0, 2],
+        "source 2": [1],
+        "source 3": [3],
+    }
+
+    faiss.remove_sources(["source 1", "unknown source"])
+    assert faiss.X_fit_ == [input_texts[1], input_texts[3]]
+    np.testing.assert_array_equal(faiss.document_ids_, [1, 3])
+    assert faiss.index_.ntotal == 2
+    assert sorted(doc["text"] for doc in faiss.query("xx")) == ["aaa", "yyy"]
+    assert "source 1" not in faiss.source_to_ids_
+    if faiss.X_embedded_ is not None:
+        assert faiss.X_embedded_.shape[0] == 2
+
+    faiss.upsert(
+        [
+            {"source": "source 2", "text": "bbb"},
+            {"source": "source 4", "text": "xxx"},
+        ]
+    )
+    np.testing.assert_array_equal(faiss.document_ids_, [3, 4, 5])
+    assert faiss.X_fit_ == [
+        {"source": "source 3", "text": "aaa"},
+        {"source": "source 2", "text": "bbb"},
+        {"source": "source 4", "text": "xxx"},
+    ]
+    assert faiss.set_params(top_k=1).query("xx") == [
+        {"source": "source 4", "text": "xxx"}
+    ]
+
+    faiss.remove_sources(["source 2", "source 3", "source 4"])
+    assert faiss.X_fit_ == []
+    assert faiss.query("xx") == []
+
+
+def test_semantic_retriever_remove_sources_error():
+    """Check the errors raised when removing documents is not possible."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [{"source": "source 1", "text": "xxx"}]
+    faiss = SemanticRetriever(embedding=embedder, index_type="hnsw")
+    faiss.fit(input_texts)
+    with pytest.raises(ValueError, match="cannot be removed"):
+        faiss.remove_sources("source 1")
+
+    faiss = SemanticRetriever(embedding=embedder).fit(["xxx"])
+    with pytest.raises(TypeError, match="upsert requires documents"):
+        faiss.upsert(["yyy"])
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("codec", ["flat", "pq"])
+def test_semantic_retriever_corpus_top_k(index_type, codec):
+    """Check that a single index serves the quota of documents of each corpus."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    corpora = {
+        "api": ["xxx", "xxxx", "xxx xxx", "xxx 1", "xxx 2", "xxx 3", "xxx 4"],
+        "user_guide": ["xxx yyy", "yyy"],
+        "gallery": ["zzz"],
+    }
+    input_texts = [
+        {"source": f"source {text}", "text": text, "corpus": corpus}
+        for corpus, texts in corpora.items()
+        for text in texts
+    ]
+    top_k = {"user_guide": 1, "api": 2, "gallery": 1}
+    faiss = SemanticRetriever(
+        embedding=embedder,
+        top_k=top_k,
+        index_type=index_type,
+        n_lists=1,
+        codec=codec,
+        pq_m=8,
+        random_state=0,
+    ).fit(input_texts)
+
+    assert faiss.corpus_to_ids_ == {
+        "api": list(range(7)),
+        "user_guide": [7, 8],
+        "gallery": [9],
+    }
+    # each quota is filled, even for the corpora whose documents are not in the
+    # top documents of the single search done over all the corpora
+    result = faiss.query("xxx", return_result=True)
+    assert list(result.corpus) == ["user_guide", "api", "api", "gallery"]
+    if codec == "flat":
+        # the documents of each corpus are the ones retrieved by a retriever
+        # fitted only on this corpus
+        expected = []
+        for corpus, quota in top_k.items():
+            expected += (
+                SemanticRetriever(embedding=embedder, top_k=quota)
+                .fit(
+                    [
+                        {"source": f"source {text}", "text": text}
+                        for text in corpora[corpus]
+                    ]
+                )
+                .query("xxx")
+            )
+        assert list(result) == expected
+    expected = faiss.query("xxx")
+    assert faiss.query_batch(["xxx", "xxx"]) == [expected, expected]
+
+    faiss.set_params(top_k={"gallery": 2})
+    assert faiss.query("xxx") == [{"source": "source zzz", "text": "zzz"}]
+
+    if index_type != "hnsw":
+        faiss.remove_sources(["source xxx yyy"])
+        assert faiss.corpus_to_ids_["user_guide"] == [8]
+        faiss.set_params(top_k={"user_guide": 1})
+        assert faiss.query("xxx") == [{"source": "source yyy", "text": "yyy"}]
+
+
+def test_semantic_retriever_corpus_top_k_error():
+    """Check the errors raised with invalid per-corpus quotas."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [{"source": "source 1", "text": "xxx", "corpus": "api"}]
+    faiss = SemanticRetriever(embedding=embedder, top_k={"gallery": 1})
+    faiss.fit(input_texts)
+    with pytest.raises(ValueError, match="are not in the index"):
+        faiss.query("xxx")
+
+    faiss.set_params(top_k={"api": 0})
+    with pytest.raises(ValueError, match="should be a positive integer"):
+        faiss.query("xxx")
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize(
+    "codec, rescore_factor", [("flat", None), ("pq", None), ("pq", 2)]
+)
+def test_semantic_retriever_filter(index_type, codec, rescore_factor):
+    """Check that the filter restricts the search to the matching documents."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [
+        {"source": "sklearn.linear_model.Ridge", "text": "xxx", "corpus": "api"},
+        {"source": "sklearn.ensemble.Bagging", "text": "xxxx", "corpus": "api"},
+        {"source": "user_guide/ensemble", "text": "xxx", "corpus": "user_guide"},
+        {"source": "sklearn.ensemble.Stacking", "text": "yyy", "corpus": "api"},
+        {"source": "user_guide/linear_model", "text": "zzz", "corpus": "user_guide"},
+    ]
+    for document, version in zip(input_texts, ["1.4", "1.5", "1.5", "1.4", "1.5"]):
+        document["version"] = version
+    faiss = SemanticRetriever(
+        embedding=embedder,
+        top_k=2,
+        index_type=index_type,
+        n_lists=1,
+        codec=codec,
+        pq_m=8,
+        rescore_factor=rescore_factor,
+        random_state=0,
+    ).fit(input_texts)
+
+    def sources(documents):
+        return sorted(document["source"] for document in documents)
+
+    # contiguous documents compiled into a range selector
+    assert sources(faiss.query("xxx", filter={"corpus": "api"})) == [
+        "sklearn.ensemble.Bagging",
+        "sklearn.linear_model.Ridge",
+    ]
+    # non-contiguous documents compiled into a bitmap selector
+    ensemble_filter = {"source": lambda source: source.startswith("sklearn.ensemble")}
+    assert sources(faiss.query("xxx", filter=ensemble_filter)) == [
+        "sklearn.ensemble.Bagging",
+        "sklearn.ensemble.Stacking",
+    ]
+    assert faiss.query_batch(["xxx", "yyy"], filter={"version": ["1.4"]}) == [
+        faiss.query("xxx", filter={"version": "1.4"}),
+        faiss.query("yyy", filter={"version": "1.4"}),
+    ]
+    assert sources(
+        faiss.query("xxx", filter={"corpus": "user_guide", "version": "1.5"})
+    ) == ["user_guide/ensemble", "user_guide/linear_model"]
+    assert faiss.query("xxx", filter={"source": "user_guide/linear_model"}) == [
+        {"source": "user_guide/linear_model", "text": "zzz"}
+    ]
+    assert faiss.query("xxx", filter={"version": "0.1"}) == []
+
+    # the filter is combined with the quotas of the corpora
+    faiss.set_params(top_k={"api": 1, "user_guide": 1})
+    assert faiss.query("xxx", filter={"version": "1.4"}) == [
+        {"source": "sklearn.linear_model.Ridge", "text": "xxx"}
+    ]
+
+    with pytest.raises(TypeError, match="filter should be a dict"):
+        faiss.query("xxx", filter="api")
+
+
+def test_semantic_retriever_filter_predicate_by_value():
+    """Check that a predicate on the sources or the corpora is evaluated once per
+    distinct value and not on each document."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [
+        {"source": f"sklearn.{module}", "text": text, "corpus": corpus}
+        for module, corpus in [("ensemble", "api"), ("linear_model", "user_guide")]
+        for text in ["xxx", "yyy", "zzz"]
+    ]
+    faiss = SemanticRetriever(embedding=embedder, top_k=6).fit(input_texts)
+
+    evaluated = []
+
+    def is_ensemble(source):
+        evaluated.append(source)
+        return source.startswith("sklearn.ensemble")
+
+    documents = faiss.query("xxx", filter={"source": is_ensemble})
+    assert sorted(evaluated) == ["sklearn.ensemble", "sklearn.linear_model"]
+    assert sorted(document["text"] for document in documents) == ["xxx", "yyy", "zzz"]
+    assert all(document["source"] == "sklearn.ensemble" for document in documents)
+
+    evaluated.clear()
+    documents = faiss.query(
+        "xxx", filter={"corpus": lambda corpus: evaluated.append(corpus) is None}
+    )
+    assert sorted(evaluated) == ["api", "user_guide"]
+    assert len(documents) == len(input_texts)
+
+
+def test_semantic_retriever_return_result():
+    """Check that the result holds the ids of the documents in the index and
+    their similarity with the query."""
+    cache_folder_path = (
+        Path(__file__).parent.parent.parent / "embedding" / "tests" / "data"
+    )
+    model_name_or_path = "sentence-transformers/paraphrase-albert-small-v2"
+
+    embedder = SentenceTransformer(
+        model_name_or_path=model_name_or_path,
+        cache_folder=str(cache_folder_path),
+        show_progress_bar=False,
+    )
+
+    input_texts = [
+        {"source": "source 1", "text": "xxx", "corpus": "api"},
+        {"source": "source 2", "text": "yyy", "corpus": "api"},
+        {"source": "source 3", "text": "zzz", "corpus": "gallery"},
+    ]
+    faiss = SemanticRetriever(embedding=embedder, top_k=2).fit(input_texts)
+    result = faiss.query("xxx", return_result=True)
+    assert list(result) == faiss.query("xxx")
+    assert result.ids[0] == 0
+    assert np.all(np.diff(result.scores) <= 0)
+    assert result.texts[0] == "xxx"
+    assert result.corpus[0] == "api"
+
+    batch = faiss.query_batch(["xxx", "zzz"], return_result=True)
+    assert [list(result) for result in batch] == faiss.query_batch(["xxx", "zzz"])
@@ -0,0 +1,148 @@
+import pickle
+
+import joblib
+import pytest
+
+from ragger_duck.retrieval import SQLiteBM25Retriever
+
+
+@pytest.mark.parametrize(
+    "input_texts, output",
+    [
+        (
+            [
+                {"source": "source 1", "text": "xxx"},
+                {"source": "source 2", "text": "yyy"},
+            ],
+            [{"source": "source 1", "text": "xxx"}],
+        ),
+        (["xxx", "yyy"], ["xxx"]),
+    ],
+)
+def test_sqlite_retriever(tmp_path, input_texts, output):
+    """Check that the SQLiteBM25Retriever wrapper works as expected"""
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=1).fit(input_texts)
+    assert retriever.query("xxx") == output
+    # fitting again replaces the documents
+    retriever.fit(["zzz", "xxx"])
+    assert retriever.query("xxx") == ["xxx"]
+
+
+def test_sqlite_retriever_ranking(tmp_path):
+    """Check that the documents are ranked by BM25 and completed with the first
+    documents when too few documents match."""
+    input_texts = [
+        "aaa bbb",
+        "xxx aaa bbb ccc ddd",
+        "xxx xxx yyy",
+        "yyy zzz",
+        "ccc",
+    ]
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=3).fit(input_texts)
+    # the operators and the punctuation of the query are not interpreted
+    assert retriever.query('XXX: (yyy "OR" -') == [
+        "xxx xxx yyy",
+        "yyy zzz",
+        "xxx aaa bbb ccc ddd",
+    ]
+    assert retriever.query("ccc") == ["ccc", "xxx aaa bbb ccc ddd", "aaa bbb"]
+    assert retriever.query("unknown") == input_texts[:3]
+    assert retriever.query("") == input_texts[:3]
+    assert len(retriever.set_params(top_k=10).query("xxx")) == len(input_texts)
+
+
+def test_sqlite_retriever_update(tmp_path):
+    """Check that documents can be added and removed by source."""
+    input_texts = [
+        {"source": "source 1", "text": "xxx aaa"},
+        {"source": "source 1", "text": "xxx bbb"},
+        {"source": "source 2", "text": "yyy"},
+    ]
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=2)
+    retriever.partial_fit(input_texts)
+    retriever.partial_fit([{"source": "source 3", "text": "zzz"}])
+    assert retriever.query("zzz") == [
+        {"source": "source 3", "text": "zzz"},
+        input_texts[0],
+    ]
+
+    retriever.remove_sources(["source 1", "unknown"])
+    assert retriever.query("xxx") == [
+        {"source": "source 2", "text": "yyy"},
+        {"source": "source 3", "text": "zzz"},
+    ]
+    retriever.upsert([{"source": "source 2", "text": "xxx ccc"}])
+    assert (
+        retriever.query("ccc")
+        == [
+            {"source": "source 3", "text": "zzz"},
+            {"source": "source 2", "text": "xxx ccc"},
+        ][::-1]
+    )
+    with pytest.raises(TypeError, match="dictionaries"):
+        retriever.upsert(["xxx"])
+
+
+def test_sqlite_retriever_read_only(tmp_path):
+    """Check that a pickled retriever can query the database in read-only mode
+    while several retrievers share it."""
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=1)
+    retriever.fit(["xxx", "yyy"])
+    retriever.query("xxx")
+    joblib.dump(retriever, tmp_path / "retriever.joblib")
+
+    readers = [
+        joblib.load(tmp_path / "retriever.joblib").set_params(read_only=True)
+        for _ in range(2)
+    ]
+    for reader in readers:
+        assert reader.query("yyy") == ["yyy"]
+    with pytest.raises(ValueError, match="read-only"):
+        readers[0].partial_fit(["zzz"])
+
+    # the readers see the documents added by the writer
+    retriever.partial_fit(["zzz"])
+    assert readers[1].query("zzz") == ["zzz"]
+
+
+def test_sqlite_retriever_pickle_keeps_connection(tmp_path):
+    """Check that pickling a retriever does not alter the original retriever."""
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=1)
+    retriever.fit(["xxx", "yyy"])
+    connection = retriever._get_connection()
+    lock = retriever._lock
+
+    state = pickle.loads(pickle.dumps(retriever)).__dict__
+    assert "_connection" not in state and "_lock" not in state
+    assert retriever._connection[0] is connection
+    assert retriever._lock is lock
+
+    joblib.dump(retriever, tmp_path / "retriever.joblib")
+    retriever.partial_fit(["zzz"])
+    assert retriever.query("zzz") == ["zzz"]
+    assert retriever._get_connection() is connection
+
+
+def test_sqlite_retriever_error(tmp_path):
+    """Check that we raise an error when the input is not a string at inference time."""
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db").fit(["xxx"])
+    with pytest.raises(TypeError):
+        retriever.query(["xxx"])
+
+
+def test_sqlite_retriever_return_result(tmp_path):
+    """Check that the result holds the row ids of the documents and their BM25
+    scores."""
+    input_texts = [
+        {"source": "source 1", "text": "aaa bbb"},
+        {"source": "source 2", "text": "xxx aaa bbb ccc"},
+        {"source": "source 3", "text": "xxx xxx yyy"},
+    ]
+    retriever = SQLiteBM25Retriever(tmp_path / "bm25.db", top_k=3).fit(input_texts)
+    result = retriever.query("xxx", return_result=True)
+    assert list(result) == retriever.query("xxx")
+    assert list(result.ids) == [3, 2, 1]
+    assert result.scores[0] > result.scores[1] > 0
+    # the padding documents do not match the query
+    assert result.scores[2] == 0
+    assert result.sources == ["source 3", "source 2", "source 1"]
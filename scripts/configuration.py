@@ -22,13 +22,14 @@ GALLERY_EXAMPLES_PATH = "../local_sklearn/scikit-learn/examples"
 
 # Path to cache the embedding and models
 CACHE_PATH = "../models"
+# Path to the database caching the embeddings of the documents between runs
+EMBEDDING_CACHE_PATH = "../models/embedding_cache.sqlite"
 
 # Path to store the retriever once trained
-API_SEMANTIC_RETRIEVER_PATH = "../models/api_semantic_retrieval.joblib"
+# A single semantic retriever holds the API, user guide and gallery corpora
+SEMANTIC_RETRIEVER_PATH = "../models/semantic_retrieval"
 API_LEXICAL_RETRIEVER_PATH = "../models/api_lexical_retrieval.joblib"
-USER_GUIDE_SEMANTIC_RETRIEVER_PATH = "../models/user_guide_semantic_retrieval.joblib"
 USER_GUIDE_LEXICAL_RETRIEVER_PATH = "../models/user_guide_lexical_retrieval.joblib"
-GALLERY_SEMANTIC_RETRIEVER_PATH = "../models/gallery_semantic_retrieval.joblib"
 GALLERY_LEXICAL_RETRIEVER_PATH = "../models/gallery_lexical_retrieval.joblib"
 
 # Parameters for the scraper
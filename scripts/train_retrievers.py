@@ -19,53 +19,37 @@ USER_GUIDE_DOC = Path(config.USER_GUIDE_DOC_PATH)
 USER_GUIDE_EXCLUDE_FOLDERS = config.USER_GUIDE_EXCLUDE_FOLDERS
 GALLERY_EXAMPLES = Path(config.GALLERY_EXAMPLES_PATH)
 DEVICE = os.getenv("DEVICE", "cpu")
+# Embed the documents with several processes on CPU only. The processes are reused
+# across the different corpora.
+EMBEDDING_N_JOBS = -1 if DEVICE == "cpu" else None
 
 logging.basicConfig(level=logging.INFO)
 
 # %% [markdown]
-# Define the training pipeline that extract the text chunks from the API documentation
-# and then embed them using a sentence transformer.
+# Extract the text chunks from the API documentation. They are embedded, together
+# with the chunks of the other corpora, by the semantic retriever trained at the end.
 
 # %%
 from sklearn.pipeline import Pipeline
 
-from ragger_duck.embedding import SentenceTransformer
-from ragger_duck.retrieval import SemanticRetriever
 from ragger_duck.scraping import APINumPyDocExtractor
 
-embedding = SentenceTransformer(
-    model_name_or_path=config.SENTENCE_TRANSFORMER_MODEL,
-    cache_folder=config.CACHE_PATH,
-    device=DEVICE,
-)
 api_scraper = APINumPyDocExtractor()
-pipeline = Pipeline(
-    steps=[
-        ("extractor", api_scraper),
-        ("semantic_retriever", SemanticRetriever(embedding=embedding, top_k=15)),
-    ]
-)
-pipeline.fit(API_DOC)
-pipeline
-
-# %% [markdown]
-# Save the semantic retriever to be used in the inference time.
-
-# %%
-joblib.dump(
-    pipeline.named_steps["semantic_retriever"], config.API_SEMANTIC_RETRIEVER_PATH
-)
+api_chunks = api_scraper.fit_transform(API_DOC)
 
 # %% [markdown]
 # Create a lexical retriever to match some keywords. We take a very long chunk to be
-# sure that the keywords are present in the chunk.
+# sure that the keywords are present in the chunk. The n-grams are hashed instead of
+# being stored in a vocabulary that would dominate the size of the saved retriever.
 
 # %%
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 
 from ragger_duck.retrieval import BM25Retriever
 
-count_vectorizer = CountVectorizer(ngram_range=(1, 5))
+count_vectorizer = HashingVectorizer(
+    ngram_range=(1, 5), n_features=2**22, alternate_sign=False, norm=None
+)
 pipeline = Pipeline(
     steps=[
         ("extractor", api_scraper),
@@ -88,38 +72,22 @@ joblib.dump(
 # %%
 from ragger_duck.scraping import UserGuideDocExtractor
 
-embedding = SentenceTransformer(
-    model_name_or_path=config.SENTENCE_TRANSFORMER_MODEL,
-    cache_folder=config.CACHE_PATH,
-    device=DEVICE,
-)
 user_guide_scraper = UserGuideDocExtractor(
     folders_to_exclude=USER_GUIDE_EXCLUDE_FOLDERS,
     chunk_size=config.CHUNK_SIZE,
     chunk_overlap=config.CHUNK_OVERLAP,
     n_jobs=-1,
 )
-pipeline = Pipeline(
-    steps=[
-        ("extractor", user_guide_scraper),
-        ("semantic_retriever", SemanticRetriever(embedding=embedding, top_k=15)),
-    ]
-)
-pipeline.fit(USER_GUIDE_DOC)
-pipeline
-
-# %%
-joblib.dump(
-    pipeline.named_steps["semantic_retriever"],
-    config.USER_GUIDE_SEMANTIC_RETRIEVER_PATH,
-)
+user_guide_chunks = user_guide_scraper.fit_transform(USER_GUIDE_DOC)
 
 # %%
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 
 from ragger_duck.retrieval import BM25Retriever
 
-count_vectorizer = CountVectorizer(ngram_range=(1, 5))
+count_vectorizer = HashingVectorizer(
+    ngram_range=(1, 5), n_features=2**22, alternate_sign=False, norm=None
+)
 user_guide_scraper = UserGuideDocExtractor(
     folders_to_exclude=USER_GUIDE_EXCLUDE_FOLDERS,
     chunk_size=config.CHUNK_SIZE,
@@ -145,31 +113,15 @@ joblib.dump(
 # %%
 from ragger_duck.scraping import GalleryExampleExtractor
 
-embedding = SentenceTransformer(
-    model_name_or_path=config.SENTENCE_TRANSFORMER_MODEL,
-    cache_folder=config.CACHE_PATH,
-    device=DEVICE,
-)
 gallery_scraper = GalleryExampleExtractor(
     chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP
 )
-pipeline = Pipeline(
-    steps=[
-        ("extractor", gallery_scraper),
-        ("semantic_retriever", SemanticRetriever(embedding=embedding, top_k=15)),
-    ]
-)
-pipeline.fit(GALLERY_EXAMPLES)
-pipeline
+gallery_chunks = gallery_scraper.fit_transform(GALLERY_EXAMPLES)
 
 # %%
-joblib.dump(
-    pipeline.named_steps["semantic_retriever"],
-    config.GALLERY_SEMANTIC_RETRIEVER_PATH,
+count_vectorizer = HashingVectorizer(
+    ngram_range=(1, 5), n_features=2**22, alternate_sign=False, norm=None
 )
-
-# %%
-count_vectorizer = CountVectorizer(ngram_range=(1, 5))
 gallery_scraper = GalleryExampleExtractor(
     chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP
 )
@@ -188,3 +140,39 @@ pipeline
 joblib.dump(
     pipeline.named_steps["lexical_retriever"], config.GALLERY_LEXICAL_RETRIEVER_PATH
 )
+
+# %% [markdown]
+# Create a single semantic retriever holding the chunks of the three corpora. Each
+# chunk is tagged with its corpus such that a query is embedded and searched once
+# while retrieving a given number of chunks from each corpus.
+
+# %%
+from ragger_duck.embedding import SentenceTransformer
+from ragger_duck.retrieval import SemanticRetriever
+
+embedding = SentenceTransformer(
+    model_name_or_path=config.SENTENCE_TRANSFORMER_MODEL,
+    cache_folder=config.CACHE_PATH,
+    device=DEVICE,
+    embedding_cache_path=config.EMBEDDING_CACHE_PATH,
+    n_jobs=EMBEDDING_N_JOBS,
+)
+chunks = [
+    {**chunk, "corpus": corpus}
+    for corpus, corpus_chunks in [
+        ("api", api_chunks),
+        ("user_guide", user_guide_chunks),
+        ("gallery", gallery_chunks),
+    ]
+    for chunk in corpus_chunks
+]
+semantic_retriever = SemanticRetriever(
+    embedding=embedding, top_k={"api": 15, "user_guide": 15, "gallery": 15}
+).fit(chunks)
+semantic_retriever
+
+# %%
+# The embedding cache only avoids embedding the corpus again in the next runs: it
+# is disabled such that the queries served by the application are not cached.
+semantic_retriever.set_params(embedding__embedding_cache_path=None)
+semantic_retriever.save(config.SEMANTIC_RETRIEVER_PATH)